@@ -1,15 +1,39 @@
 import os
 import time
 import requests
+import httpx
 import logging
 import bcrypt
 import jwt
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, has_request_context, request, jsonify, render_template, send_from_directory, abort
 from flask_cors import CORS
+from flask_sock import Sock
+from memory_index import MemoryIndex
+from logging_setup import configure_logging
+from llm_client import (
+    OPENROUTER_MODEL, MIN_LLM_BUDGET, elapsed_ms, configure_usage,
+    make_openrouter_request, generate_summary, pending_usage_tokens, usage_number
+)
+from sqlite_store import SQLiteClient
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.session import Session
+    from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+except ImportError:
+    Profiler = None
 import re
+import json
+import uuid
+import threading
+import tempfile
+import zlib
+import random
+from collections import OrderedDict
 
 # --- Initialization ---
 load_dotenv()
@@ -17,28 +41,175 @@ load_dotenv()
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 # Configure CORS for production
-CORS(app, origins=["*"], methods=["GET", "POST"], allow_headers=["Content-Type", "Authorization"])
+CORS(app, origins=["*"], methods=["GET", "POST"], allow_headers=["Content-Type", "Authorization", "X-Profile"])
+
+# WebSocket support; protocol-level pings detect dead connections
+app.config['SOCK_SERVER_OPTIONS'] = {
+    'ping_interval': int(os.environ.get('WS_PING_INTERVAL', 25)),
+    'max_message_size': 16 * 1024
+}
+sock = Sock(app)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (structured JSON, written off the request thread)
+configure_logging(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logging.getLogger("httpx").setLevel(logging.WARNING)  # One line per Supabase call otherwise
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase with environment variables (for database only, not auth)
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
+# Upper bound for any single database call; within a request each call is also
+# cut to the remaining deadline (see safe_database_operation)
+SUPABASE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", 5))
+DB_WRITE_TIMEOUT = 1.5  # Bound for each write made after the LLM call
+
+_db_call = threading.local()  # Timeout of the database call running on this thread
+
+def current_db_call_timeout():
+    """Timeout set by safe_database_operation for this thread's call, if any."""
+    return getattr(_db_call, 'timeout', None)
+
+def apply_db_call_timeout(request):
+    """httpx request hook: replace the client-wide timeout with the per-call one."""
+    timeout = current_db_call_timeout()
+    if timeout is not None:
+        request.extensions["timeout"] = httpx.Timeout(timeout).as_dict()
+
+# Storage backend: "supabase" (hosted Postgres) or "sqlite" (embedded, single node)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "supabase").lower()
+
+if STORAGE_BACKEND == "sqlite":
+    supabase = SQLiteClient(os.environ.get("SQLITE_PATH", "daddy_john.db"), timeout=SUPABASE_TIMEOUT, call_timeout=current_db_call_timeout)
+elif STORAGE_BACKEND == "supabase":
+    # Initialize Supabase with environment variables (for database only, not auth)
+    url: str = os.environ.get("SUPABASE_URL")
+    key: str = os.environ.get("SUPABASE_KEY")
+
+    if not url or not key:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables (or set STORAGE_BACKEND=sqlite)")
 
-if not url or not key:
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+    supabase: Client = create_client(url, key, options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT))
+    supabase.postgrest.session.event_hooks['request'].append(apply_db_call_timeout)
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
 
-supabase: Client = create_client(url, key)
+# LLM usage rows are buffered by llm_client and flushed here
+configure_usage(supabase)
 
 # JWT Secret Key
 JWT_SECRET = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# OpenRouter model prefixes that only cache prompts when given cache_control breakpoints;
+# others (e.g. OpenAI, DeepSeek) cache a byte-stable prefix automatically
+PROMPT_CACHE_HINT_MODELS = tuple(
+    m.strip() for m in os.environ.get("PROMPT_CACHE_HINT_MODELS", "anthropic/,google/gemini").split(",") if m.strip()
+)
+
+# LLM usage quota (usage accounting itself lives in llm_client.py)
+DAILY_TOKEN_LIMIT = int(os.environ.get("DAILY_TOKEN_LIMIT", 0))  # Per-user tokens per UTC day, 0 disables
+QUOTA_REPLY = "We've talked a lot today, kiddo. Let's pick this up again tomorrow."
+
+# Request deadlines
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 20))
+MIN_DB_BUDGET = 0.5  # Skip a database call with less time than this left
+# Budget held back from the LLM so the writes after it still fit: the assistant
+# message and the snapshot RPC for a chat turn, the summary and its snapshot
+# update for a summary. Each of them is bounded by DB_WRITE_TIMEOUT.
+WRITE_RESERVE_SECONDS = 2 * DB_WRITE_TIMEOUT
+
+# Conversation state snapshot
+RECENT_MESSAGES_LIMIT = 20  # Messages kept in conversation_state.recent_messages
+SUMMARY_INTERVAL = 20  # Summarize every N stored messages
+
+# Long-term memory index
+MEMORY_INDEX_DIR = os.environ.get("MEMORY_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "daddyjohn-memory")
+MEMORY_TOP_K = 3  # Past snippets injected into the prompt
+MEMORY_SEARCH_BUDGET_MS = 5  # Warn when a search takes longer than this
+
+memory_index = MemoryIndex(MEMORY_INDEX_DIR)
+_memory_builds = set()
+_memory_pending = {}  # user_id -> texts remembered while the user's index was being built
+_memory_builds_lock = threading.Lock()
+
+# Readiness probes
+READINESS_PROBE_INTERVAL = float(os.environ.get("READINESS_PROBE_INTERVAL", 15))
+READINESS_PROBE_TIMEOUT = 3
+DB_SLOW_MS = 500
+LLM_SLOW_MS = 2000
+OPENROUTER_PROBE_URL = os.environ.get("OPENROUTER_PROBE_URL", "https://openrouter.ai/api/v1/auth/key")
+
+# Request profiling (requires pyinstrument)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))  # Fraction of API requests profiled
+PROFILE_INTERVAL = 0.001  # Seconds between profiler samples
+PROFILE_MAX_STORED = 50  # Most recent profiles kept on disk
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "daddyjohn-profiles")  # Shared by all workers
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "").split(",") if e.strip()}
+
+# Conversation export
+EXPORT_PAGE_SIZE = 1000  # Messages read per keyset page
+PARTITION_MAINTENANCE_INTERVAL = 6 * 3600  # Seconds between ensure_messages_partitions() calls
+
+# Fingerprinted static assets (generated by build_assets.py)
+STATIC_DIST_DIR = os.path.join(app.static_folder, 'dist')
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def load_asset_manifest():
+    """Load the asset manifest written by build_assets.py, if present."""
+    try:
+        with open(os.path.join(STATIC_DIST_DIR, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.info("No asset manifest found, serving unfingerprinted static files")
+        return {}
+    except Exception as e:
+        logger.warning("Could not load asset manifest: %s", e)
+        return {}
+
+ASSET_MANIFEST = load_asset_manifest()
+
+@app.template_global()
+def asset_url(filename: str) -> str:
+    """Resolve a static file to its fingerprinted URL."""
+    return f"/static/{ASSET_MANIFEST.get(filename, filename)}"
+
+# WebSocket chat transport
+WS_AUTH_TIMEOUT = 10  # Seconds a new connection has to authenticate
+WS_IDLE_TIMEOUT = 300  # Close connections with no client frames for this long
+WS_REPLY_CACHE_SIZE = 1000  # Completed/in-flight turns cached in this process
+WS_TURN_STALE_SECONDS = REQUEST_DEADLINE_SECONDS + 30  # Pending longer than this means the worker died
+WS_TURN_RETENTION_SECONDS = 24 * 3600  # ws_turns rows older than this are pruned
+WS_TURN_PRUNE_PROBABILITY = 0.01  # Fraction of new turns that also prune old rows
+
+# Rendered HTML pages, keyed by template name
+_page_cache = {}
+
 # --- Helper Functions ---
 
+_persona = None  # persona.txt contents, read once
+
+class Deadline:
+    """Time budget for one request, shared by every downstream call."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least `seconds` of budget remain."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: float) -> float:
+        """Timeout for a downstream call: the remaining budget, at most `cap`."""
+        return min(cap, self.remaining())
+
+    def reserve(self, seconds: float) -> "Deadline":
+        """A deadline that expires `seconds` earlier, leaving that much for later work."""
+        child = Deadline(0)
+        child.expires_at = self.expires_at - seconds
+        return child
+
 def sanitize_input(text: str) -> str:
     """Sanitize user input to prevent injection attacks."""
     if not text or not isinstance(text, str):
@@ -99,11 +270,38 @@ def get_user_from_token(auth_header):
             'id': payload['user_id'],
             'email': payload['email']
         }
+        if has_request_context():
+            g.user_id = user['id']  # Picked up by the structured logger
         return user, None
     except Exception as e:
-        logger.error(f"Token validation error: {str(e)}")
+        logger.error("Token validation error: %s", e)
         return None, {"error": "Invalid or expired token"}
 
+_partition_maintainer_started = False
+_partition_maintainer_lock = threading.Lock()
+
+def ensure_messages_partitions():
+    """Create upcoming monthly partitions of the messages table."""
+    try:
+        supabase.rpc('ensure_messages_partitions', {}).execute()
+    except Exception as e:
+        logger.warning("Could not ensure messages partitions: %s", e)
+
+def partition_maintainer_loop():
+    # Runs in every worker; the function is idempotent and cheap once partitions exist
+    while True:
+        ensure_messages_partitions()
+        time.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+def start_partition_maintainer():
+    """Start the periodic partition maintainer once per process."""
+    global _partition_maintainer_started
+    with _partition_maintainer_lock:
+        if _partition_maintainer_started:
+            return
+        _partition_maintainer_started = True
+    threading.Thread(target=partition_maintainer_loop, daemon=True).start()
+
 def ensure_tables_exist():
     """Ensure required database tables exist."""
     try:
@@ -111,7 +309,7 @@ def ensure_tables_exist():
         supabase.table('messages').select('id').limit(1).execute()
         logger.info("Messages table exists")
     except Exception as e:
-        logger.warning(f"Messages table might not exist: {str(e)}")
+        logger.warning("Messages table might not exist: %s", e)
         # Create the table if it doesn't exist
         try:
             supabase.rpc('create_messages_table').execute()
@@ -123,77 +321,204 @@ def ensure_tables_exist():
         supabase.table('summaries').select('id').limit(1).execute()
         logger.info("Summaries table exists")
     except Exception as e:
-        logger.warning(f"Summaries table might not exist: {str(e)}")
+        logger.warning("Summaries table might not exist: %s", e)
 
-def safe_database_operation(operation, fallback_value=None):
-    """Safely execute database operations with fallback."""
+    try:
+        # Check if conversation_state table exists
+        supabase.table('conversation_state').select('user_id').limit(1).execute()
+        logger.info("Conversation state table exists")
+    except Exception as e:
+        logger.warning("Conversation state table might not exist: %s", e)
+
+def safe_database_operation(operation, fallback_value=None, deadline=None, timeout=SUPABASE_TIMEOUT):
+    """Safely execute database operations with fallback.
+
+    The call is bounded by `timeout`, cut to the remaining request deadline,
+    and skipped when the deadline can no longer fit a database round trip.
+    """
+    if deadline is not None:
+        if not deadline.allows(MIN_DB_BUDGET):
+            logger.warning("Skipping database operation: request deadline exceeded")
+            return fallback_value, "Request deadline exceeded"
+        timeout = deadline.timeout(timeout)
+
+    _db_call.timeout = timeout
     try:
         result = operation()
         return result, None
     except Exception as e:
-        logger.error(f"Database operation failed: {str(e)}")
+        logger.error("Database operation failed: %s", e)
         return fallback_value, str(e)
+    finally:
+        _db_call.timeout = None
+
+def get_conversation_state(user_id, deadline=None):
+    """Fetch the user's conversation snapshot with a single primary-key lookup."""
+    state = {"latest_summary": "", "message_count": 0, "recent_messages": []}
+
+    result, error = safe_database_operation(
+        lambda: supabase.table('conversation_state').select('latest_summary, message_count, recent_messages').eq('user_id', user_id).limit(1).execute(),
+        deadline=deadline
+    )
+
+    if result and result.data:
+        row = result.data[0]
+        state["latest_summary"] = row.get('latest_summary') or ""
+        state["message_count"] = row.get('message_count') or 0
+        state["recent_messages"] = row.get('recent_messages') or []
+
+    return state
+
+def record_conversation_turn(user_id, turn_messages, deadline=None, timeout=SUPABASE_TIMEOUT):
+    """Atomically append a turn to the user's conversation snapshot."""
+    result, error = safe_database_operation(
+        lambda: supabase.rpc('record_conversation_turn', {
+            "p_user_id": user_id,
+            "p_messages": turn_messages,
+            "p_max_recent": RECENT_MESSAGES_LIMIT
+        }).execute(),
+        deadline=deadline,
+        timeout=timeout
+    )
+
+    if error:
+        logger.warning("Could not update conversation state: %s", error)
+        return None
+
+    return result.data if result else None
+
+def build_memory_index(user_id):
+    """Index a user's past messages from the messages table.
+
+    Messages remembered while the build runs are appended afterwards,
+    unless the table scan already picked them up.
+    """
+    built = []
+    try:
+        if not memory_index.warm(user_id):
+            built = [row['content'] for row in iter_user_messages(user_id) if row['role'] == 'user']
+            memory_index.build(user_id, built)
+            logger.info("Built memory index for user %s (%s messages)", user_id, len(built))
+    except Exception as e:
+        logger.warning("Could not build memory index: %s", e)
+
+    while True:
+        with _memory_builds_lock:
+            pending = _memory_pending.pop(user_id, [])
+            if not pending:
+                _memory_builds.discard(user_id)
+                return
+        already_indexed = set(built[-len(pending):])
+        try:
+            memory_index.add(user_id, [t for t in pending if t not in already_indexed])
+        except Exception as e:
+            logger.warning("Could not update memory index: %s", e)
+
+def schedule_memory_build(user_id):
+    """Load or build a user's memory index in the background, once at a time."""
+    with _memory_builds_lock:
+        if user_id in _memory_builds:
+            return
+        _memory_builds.add(user_id)
+    threading.Thread(target=build_memory_index, args=(user_id,), daemon=True).start()
+
+def recall_memories(user_id, query, exclude=()):
+    """Return the most relevant past snippets without blocking on index loads."""
+    if not memory_index.loaded(user_id):
+        schedule_memory_build(user_id)
+        return []
+
+    started = time.perf_counter()
+    try:
+        results = memory_index.search(user_id, query, k=MEMORY_TOP_K, exclude=exclude)
+    except Exception as e:
+        logger.warning("Memory search failed: %s", e)
+        return []
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms > MEMORY_SEARCH_BUDGET_MS:
+        logger.warning("Memory search took %.1fms for user %s", elapsed_ms, user_id)
+    return [text for score, text in results]
+
+def remember_message(user_id, text):
+    """Add a stored message to the user's memory index, loading it from disk if needed.
+
+    Users without an index on disk get one built in the background, and
+    the message is appended once the build finishes.
+    """
+    try:
+        if memory_index.add(user_id, [text]):
+            return
+    except Exception as e:
+        logger.warning("Could not update memory index: %s", e)
+        return
+
+    with _memory_builds_lock:
+        _memory_pending.setdefault(user_id, []).append(text)
+    schedule_memory_build(user_id)
 
 def get_persona():
-    """Reads the persona from the text file."""
+    """Reads the persona from the text file (once per process, so the prompt prefix stays byte-stable)."""
+    global _persona
+    if _persona is not None:
+        return _persona
+
     try:
         persona_path = os.path.join(os.path.dirname(__file__), 'persona.txt')
         with open(persona_path, 'r', encoding='utf-8') as f:
-            return f.read().strip()
+            _persona = f.read().strip()
+            return _persona
     except FileNotFoundError:
         logger.warning("persona.txt not found, using fallback")
         return "You are Daddy John, a helpful, caring, and supportive digital dad who gives advice with warmth and humor."
     except Exception as e:
-        logger.error(f"Error reading persona: {str(e)}")
+        logger.error("Error reading persona: %s", e)
         return "You are Daddy John, a helpful, caring, and supportive digital dad who gives advice with warmth and humor."
 
-def make_openrouter_request(messages, timeout=25, max_retries=3):
-    """Make a request to OpenRouter API with retry logic."""
-    api_key = os.environ.get("OPENROUTER_API_KEY")
-    if not api_key:
-        logger.error("OPENROUTER_API_KEY not found in environment variables")
-        return "I'm having trouble connecting to my brain right now, kiddo. Can you try again in a moment?"
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": os.environ.get("VERCEL_URL", "http://localhost:5000"),
-                    "X-Title": "Daddy John Chatbot"
-                },
-                json={
-                    "model": "cognitivecomputations/dolphin3.0-r1-mistral-24b:free",
-                    "messages": messages,
-                    "temperature": 0.7
-                },
-                timeout=timeout
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            if 'choices' not in result or not result['choices']:
-                raise ValueError("Invalid API response format")
-                
-            return result['choices'][0]['message']['content']
-            
-        except requests.exceptions.Timeout:
-            logger.warning(f"OpenRouter API timeout on attempt {attempt + 1}")
-            if attempt < max_retries - 1:
-                time.sleep(1)
-            else:
-                return "I'm thinking a bit slowly right now. Can you try asking me again?"
-        except requests.exceptions.RequestException as e:
-            logger.error(f"OpenRouter API error on attempt {attempt + 1}: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(1)
-            else:
-                return "I'm having trouble with my thoughts right now. Please try again in a moment."
-        except Exception as e:
-            logger.error(f"Unexpected error in OpenRouter request: {str(e)}")
-            return "Something went wrong in my thinking process. Let me try to help you anyway!"
+def supports_prompt_cache_hints(model):
+    """Whether the model needs explicit cache_control breakpoints to cache prompts."""
+    return any(model.startswith(prefix) for prefix in PROMPT_CACHE_HINT_MODELS)
+
+def build_prompt_prefix(latest_summary):
+    """Build the persona + background-context system messages.
+
+    The prefix only changes when a new summary is written, so providers can
+    reuse it across turns. For models that need explicit hints, the last
+    prefix message carries a cache_control breakpoint.
+    """
+    context_prompt = f"BACKGROUND CONTEXT (use this for memory but prioritize the user's last message):\n{latest_summary}\n\n---\n\nCURRENT CONVERSATION:" if latest_summary else "CURRENT CONVERSATION:"
+
+    prefix = [
+        {"role": "system", "content": get_persona()},
+        {"role": "system", "content": context_prompt}
+    ]
+
+    if supports_prompt_cache_hints(OPENROUTER_MODEL):
+        prefix[-1]["content"] = [{
+            "type": "text",
+            "text": context_prompt,
+            "cache_control": {"type": "ephemeral"}
+        }]
+    return prefix
+
+# --- LLM Usage Quota ---
+
+def get_user_tokens_today(user_id, deadline=None):
+    """Tokens the user has used today (UTC), for quota checks.
+
+    Sums today's llm_usage rows, which cover every process, through the
+    (user_id, created_at) index, then adds this process's rows that have not
+    been flushed yet.
+    """
+    now = datetime.utcnow()
+    today = now.strftime('%Y-%m-%d')
+    midnight = now.strftime('%Y-%m-%dT00:00:00+00:00')
+    result, error = safe_database_operation(
+        lambda: supabase.table('llm_usage').select('total_tokens').eq('user_id', user_id).gte('created_at', midnight).execute(),
+        deadline=deadline
+    )
+    stored = sum(usage_number(row.get('total_tokens')) for row in (result.data or [])) if result else 0
+    return stored + pending_usage_tokens(user_id, today)
 
 def clean_ai_response(response_content):
     """Clean AI response to remove unwanted prefixes."""
@@ -216,6 +541,7 @@ def clean_ai_response(response_content):
 @app.route('/api/login', methods=['POST'])
 def login():
     """Custom login endpoint for invited users."""
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
     try:
         data = request.get_json()
         if not data:
@@ -229,11 +555,12 @@ def login():
         
         # Check if user exists in invited_users table
         user_response, error = safe_database_operation(
-            lambda: supabase.table('invited_users').select('id, email, password_hash, is_active').eq('email', email).execute()
+            lambda: supabase.table('invited_users').select('id, email, password_hash, is_active').eq('email', email).execute(),
+            deadline=deadline
         )
         
         if error:
-            logger.error(f"Database error during login: {error}")
+            logger.error("Database error during login: %s", error)
             return jsonify({"error": "Login service temporarily unavailable"}), 503
             
         if not user_response or not user_response.data:
@@ -260,12 +587,131 @@ def login():
         })
             
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         return jsonify({"error": "An unexpected error occurred"}), 500
 
+def process_chat_message(user_id, user_message, on_chunk=None, deadline=None):
+    """Run one chat turn for a user and return the assistant's reply.
+
+    Shared by the HTTP and WebSocket transports. When on_chunk is given the
+    reply is streamed to it before the cleaned reply is returned. Every
+    downstream call draws on the same deadline.
+    """
+    if deadline is None:
+        deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+
+    if DAILY_TOKEN_LIMIT and get_user_tokens_today(user_id, deadline=deadline) >= DAILY_TOKEN_LIMIT:
+        logger.info("User %s reached the daily token limit", user_id)
+        if on_chunk is not None:
+            on_chunk(QUOTA_REPLY)
+        return QUOTA_REPLY
+
+    timings = {}
+    turn_started = time.perf_counter()
+
+    # Try to store user message (non-blocking)
+    message_stored = False
+    stage_started = time.perf_counter()
+    store_result, store_error = safe_database_operation(
+        lambda: supabase.table('messages').insert({
+            "user_id": user_id,
+            "role": "user",
+            "content": user_message
+        }).execute(),
+        deadline=deadline
+    )
+    
+    if store_error:
+        logger.warning("Could not store user message: %s", store_error)
+    else:
+        message_stored = True
+    timings["store_message_ms"] = elapsed_ms(stage_started)
+    
+    # Get conversation snapshot (with fallback)
+    chat_history = []
+    latest_summary = ""
+    message_count = 0
+
+    if message_stored:
+        stage_started = time.perf_counter()
+        state = get_conversation_state(user_id, deadline=deadline)
+        chat_history = state["recent_messages"]
+        latest_summary = state["latest_summary"]
+        message_count = state["message_count"]
+        timings["load_state_ms"] = elapsed_ms(stage_started)
+
+    # Recall relevant snippets from older history
+    memories = []
+    if message_stored:
+        recent_texts = {m.get('content') for m in chat_history}
+        recent_texts.add(user_message)
+        stage_started = time.perf_counter()
+        memories = recall_memories(user_id, user_message, exclude=recent_texts)
+        timings["recall_ms"] = elapsed_ms(stage_started)
+
+    # Prepare AI prompt: cacheable prefix first, per-turn content after it
+    prompt_messages = build_prompt_prefix(latest_summary)
+
+    if memories:
+        memory_prompt = "THINGS THE USER SAID EARLIER (only mention if relevant):\n" + "\n".join(f"- {m}" for m in memories)
+        prompt_messages.append({"role": "system", "content": memory_prompt})
+    
+    # Add recent history if available
+    if chat_history:
+        prompt_messages.extend(chat_history[-10:])  # Last 10 messages
+    
+    # Add current message
+    prompt_messages.append({"role": "user", "content": user_message})
+    
+    # Get AI response
+    stage_started = time.perf_counter()
+    ai_response_content = make_openrouter_request(prompt_messages, on_chunk=on_chunk, deadline=deadline.reserve(WRITE_RESERVE_SECONDS), user_id=user_id, kind="chat")
+    ai_response_content = clean_ai_response(ai_response_content)
+    timings["llm_ms"] = elapsed_ms(stage_started)
+
+    # Store AI response and update the snapshot. These writes are not gated on
+    # the deadline: the user message is already stored, and skipping them would
+    # leave messages and conversation_state out of step. WRITE_RESERVE_SECONDS
+    # keeps room for both at DB_WRITE_TIMEOUT each.
+    if message_stored:
+        stage_started = time.perf_counter()
+        remember_message(user_id, user_message)
+
+        safe_database_operation(
+            lambda: supabase.table('messages').insert({
+                "user_id": user_id,
+                "role": "assistant",
+                "content": ai_response_content
+            }).execute(),
+            timeout=DB_WRITE_TIMEOUT
+        )
+
+        turn_messages = [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": ai_response_content}
+        ]
+        record_conversation_turn(user_id, turn_messages, timeout=DB_WRITE_TIMEOUT)
+        timings["save_turn_ms"] = elapsed_ms(stage_started)
+
+        # Check if summarization is needed (non-blocking)
+        new_message_count = message_count + len(turn_messages)
+        if new_message_count // SUMMARY_INTERVAL > message_count // SUMMARY_INTERVAL:
+            stage_started = time.perf_counter()
+            try:
+                summarize_conversation_async(user_id, chat_history + turn_messages, deadline=deadline)
+            except Exception as e:
+                logger.warning("Summarization failed: %s", e)
+            timings["summarize_ms"] = elapsed_ms(stage_started)
+
+    timings["total_ms"] = elapsed_ms(turn_started)
+    logger.info("Chat turn completed", extra={"user_id": user_id, "timings_ms": timings})
+
+    return ai_response_content
+
 @app.route('/api/chat', methods=['POST'])
 def chat_handler():
     """Main endpoint to handle chat requests."""
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
     try:
         # Validate user authentication
         user, error = get_user_from_token(request.headers.get("Authorization"))
@@ -284,117 +730,604 @@ def chat_handler():
             # If empty message, return a friendly response without processing
             return jsonify({"reply": "Hey there! What's on your mind today?"})
 
-        # Try to store user message (non-blocking)
-        message_stored = False
-        store_result, store_error = safe_database_operation(
-            lambda: supabase.table('messages').insert({
-                "user_id": user_id,
-                "role": "user",
-                "content": user_message
-            }).execute()
-        )
-        
-        if store_error:
-            logger.warning(f"Could not store user message: {store_error}")
-        else:
-            message_stored = True
-        
-        # Get chat history (with fallback)
-        chat_history = []
-        latest_summary = ""
+        ai_response_content = process_chat_message(user_id, user_message, deadline=deadline)
+        return jsonify({"reply": ai_response_content})
         
-        if message_stored:
-            history_result, history_error = safe_database_operation(
-                lambda: supabase.table('messages').select('role, content').eq('user_id', user_id).order('created_at', desc=True).limit(20).execute()
-            )
-            
-            if history_result and history_result.data:
-                chat_history = list(reversed(history_result.data))
-            
-            summary_result, summary_error = safe_database_operation(
-                lambda: supabase.table('summaries').select('summary_text').eq('user_id', user_id).order('created_at', desc=True).limit(1).execute()
-            )
-            
-            if summary_result and summary_result.data:
-                latest_summary = summary_result.data[0]['summary_text']
+    except Exception as e:
+        logger.error("Unexpected error in chat_handler: %s", e)
+        return jsonify({"reply": "I'm having a bit of trouble right now, but I'm here for you. Can you try asking me again?"})
 
-        # Prepare AI prompt
-        system_prompt = get_persona()
-        context_prompt = f"BACKGROUND CONTEXT (use this for memory but prioritize the user's last message):\n{latest_summary}\n\n---\n\nCURRENT CONVERSATION:" if latest_summary else "CURRENT CONVERSATION:"
+def iter_user_messages(user_id, page_size=EXPORT_PAGE_SIZE):
+    """Yield a user's messages oldest-first, one keyset-paginated page at a time."""
+    last = None
+    while True:
+        # Pages are ordered by (created_at, id) so rows sharing a timestamp are never skipped
+        rows = supabase.rpc('messages_page', {
+            "p_user_id": user_id,
+            "p_after_created_at": last["created_at"] if last else None,
+            "p_after_id": last["id"] if last else None,
+            "p_limit": page_size
+        }).execute().data or []
 
-        prompt_messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "system", "content": context_prompt}
-        ]
-        
-        # Add recent history if available
-        if chat_history:
-            prompt_messages.extend(chat_history[-10:])  # Last 10 messages
-        
-        # Add current message
-        prompt_messages.append({"role": "user", "content": user_message})
-        
-        # Get AI response
-        ai_response_content = make_openrouter_request(prompt_messages)
-        ai_response_content = clean_ai_response(ai_response_content)
+        # PostgREST caps each response at db-max-rows, which may be below
+        # page_size, so a short page does not mean the end; only an empty one does
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1]
 
-        # Try to store AI response (non-blocking)
-        if message_stored:
-            safe_database_operation(
-                lambda: supabase.table('messages').insert({
-                    "user_id": user_id,
-                    "role": "assistant",
-                    "content": ai_response_content
-                }).execute()
-            )
+def generate_export(user_id, compress=False):
+    """Stream a user's history as NDJSON lines, optionally gzip-compressed.
 
-        # Check if summarization is needed (non-blocking)
-        if message_stored and chat_history:
-            total_messages = len(chat_history) + 1
-            if total_messages > 0 and total_messages % 20 == 0:
-                try:
-                    summarize_conversation_async(user_id, chat_history)
-                except Exception as e:
-                    logger.warning(f"Summarization failed: {str(e)}")
+    If a page fetch fails mid-stream the error propagates, so the server drops
+    the connection without the final chunk (or gzip trailer) and the client
+    sees an incomplete download.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    exported = 0
 
-        return jsonify({"reply": ai_response_content})
-        
+    try:
+        for row in iter_user_messages(user_id):
+            buffer.append(json.dumps({
+                "role": row['role'],
+                "content": row['content'],
+                "created_at": row['created_at']
+            }, ensure_ascii=False) + "\n")
+            exported += 1
+
+            if len(buffer) >= 100:
+                chunk = "".join(buffer).encode('utf-8')
+                buffer = []
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
     except Exception as e:
-        logger.error(f"Unexpected error in chat_handler: {str(e)}")
-        return jsonify({"reply": "I'm having a bit of trouble right now, but I'm here for you. Can you try asking me again?"})
+        # Abort the chunked response: a well-formed but truncated file would look complete
+        logger.error("Export failed for user %s after %s messages: %s", user_id, exported, e)
+        raise
+
+    chunk = "".join(buffer).encode('utf-8')
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+    logger.info("Exported %s messages for user %s", exported, user_id)
+
+@app.route('/api/export', methods=['GET'])
+def export_handler():
+    """Stream the authenticated user's full chat history as NDJSON.
+
+    Pass ``?format=gzip`` for a gzip-compressed download.
+    """
+    user, error = get_user_from_token(request.headers.get("Authorization"))
+    if error:
+        return jsonify(error), 401
+
+    compress = request.args.get('format') == 'gzip'
+    filename = "chat-history.ndjson.gz" if compress else "chat-history.ndjson"
 
-def summarize_conversation_async(user_id, history):
+    return Response(
+        generate_export(user['id'], compress=compress),
+        mimetype='application/gzip' if compress else 'application/x-ndjson',
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def summarize_conversation_async(user_id, history, deadline=None):
     """Generates and stores a summary of the conversation asynchronously."""
     try:
         if not history:
             return
-            
-        summary_prompt = "Summarize the key points of this conversation in 1-2 sentences. Focus on the user's main concerns, emotional state, and any important context that should be remembered for future conversations."
-        messages_for_summary = [{"role": m["role"], "content": m["content"]} for m in history[-10:]]
-        messages_for_summary.insert(0, {"role": "system", "content": summary_prompt})
 
-        summary_text = make_openrouter_request(messages_for_summary, timeout=30)
+        if deadline is not None and not deadline.allows(MIN_LLM_BUDGET + WRITE_RESERVE_SECONDS):
+            logger.info("Skipping summary for user %s: request deadline exceeded", user_id)
+            return
+            
+        llm_deadline = deadline.reserve(WRITE_RESERVE_SECONDS) if deadline is not None else None
+        summary_text = generate_summary(history, timeout=30, deadline=llm_deadline, user_id=user_id)
         
-        if summary_text and "trouble" not in summary_text.lower():
+        if summary_text:
             safe_database_operation(
                 lambda: supabase.table('summaries').insert({
                     "user_id": user_id, 
                     "summary_text": summary_text
-                }).execute()
+                }).execute(),
+                timeout=DB_WRITE_TIMEOUT
+            )
+            safe_database_operation(
+                lambda: supabase.table('conversation_state').upsert({
+                    "user_id": user_id,
+                    "latest_summary": summary_text
+                }).execute(),
+                timeout=DB_WRITE_TIMEOUT
+            )
+            logger.info("Successfully stored summary for user %s", user_id)
+
+    except Exception as e:
+        logger.error("Summary generation error: %s", e)
+
+# --- WebSocket Chat ---
+
+# Turn state lives in the ws_turns table so a client that reconnects to
+# another worker can still resume; this process keeps a small cache of it.
+# (user_id, client message id) -> {"status": "pending"|"done", "reply": str, "started_at": float}
+_ws_turns = OrderedDict()
+_ws_turns_lock = threading.Lock()
+
+def cache_ws_turn(user_id, message_id, turn):
+    with _ws_turns_lock:
+        _ws_turns[(user_id, message_id)] = turn
+        _ws_turns.move_to_end((user_id, message_id))
+        while len(_ws_turns) > WS_REPLY_CACHE_SIZE:
+            _ws_turns.popitem(last=False)
+
+def is_stale_turn(turn):
+    """A pending turn older than any request can run was lost with its worker."""
+    return turn["status"] == "pending" and time.time() - (turn.get("started_at") or 0) > WS_TURN_STALE_SECONDS
+
+def remember_ws_turn(user_id, message_id, status, reply=None):
+    """Record a socket turn so a reconnecting client can resume it on any worker."""
+    turn = {"status": status, "reply": reply, "started_at": time.time()}
+    cache_ws_turn(user_id, message_id, turn)
+    safe_database_operation(
+        lambda: supabase.table('ws_turns').upsert({
+            "user_id": user_id,
+            "message_id": message_id,
+            **turn
+        }).execute()
+    )
+
+def lookup_ws_turn(user_id, message_id):
+    """Return the recorded state of a socket turn, or None if unknown or lost."""
+    with _ws_turns_lock:
+        turn = _ws_turns.get((user_id, message_id))
+
+    if turn is None or turn["status"] == "pending":
+        result, error = safe_database_operation(
+            lambda: supabase.table('ws_turns').select('status, reply, started_at').eq('user_id', user_id).eq('message_id', message_id).limit(1).execute()
+        )
+        if result and result.data:
+            turn = result.data[0]
+            cache_ws_turn(user_id, message_id, turn)
+
+    if turn is None or is_stale_turn(turn):
+        return None
+    return turn
+
+def claim_ws_turn(user_id, message_id):
+    """Mark a new turn pending unless its id was already seen.
+
+    Returns None when the caller should process the message, or the existing
+    turn when it is already pending or done (a re-sent frame). The insert
+    fails on the primary key if any worker has seen the id before.
+    """
+    turn = {"status": "pending", "reply": None, "started_at": time.time()}
+    result, error = safe_database_operation(
+        lambda: supabase.table('ws_turns').insert({
+            "user_id": user_id,
+            "message_id": message_id,
+            **turn
+        }).execute()
+    )
+
+    if error:
+        existing = lookup_ws_turn(user_id, message_id)
+        if existing is not None:
+            return existing
+        # Lost with its worker, or the database is unreachable: run it here
+        remember_ws_turn(user_id, message_id, "pending")
+        return None
+
+    cache_ws_turn(user_id, message_id, turn)
+    if random.random() < WS_TURN_PRUNE_PROBABILITY:
+        safe_database_operation(
+            lambda: supabase.table('ws_turns').delete().lt('started_at', time.time() - WS_TURN_RETENTION_SECONDS).execute()
+        )
+    return None
+
+def authenticate_socket(ws):
+    """Wait for the client's auth frame and return the token payload."""
+    raw = ws.receive(timeout=WS_AUTH_TIMEOUT)
+    if raw is None:
+        return None
+
+    try:
+        frame = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+
+    if not isinstance(frame, dict) or frame.get("type") != "auth":
+        return None
+    return verify_jwt_token(frame.get("token", ""))
+
+def run_ws_turn(send, user_id, message_id, user_message):
+    """Process one socket message, streaming chunks and the final reply."""
+    def on_chunk(delta):
+        send({"type": "chunk", "id": message_id, "delta": delta})
+
+    try:
+        reply = process_chat_message(user_id, user_message, on_chunk=on_chunk)
+    except Exception as e:
+        logger.error("Unexpected error in socket turn: %s", e)
+        reply = "I'm having a bit of trouble right now, but I'm here for you. Can you try asking me again?"
+
+    remember_ws_turn(user_id, message_id, "done", reply)
+    send({"type": "reply", "id": message_id, "reply": reply})
+
+@sock.route('/ws/chat')
+def chat_socket(ws):
+    """Chat over a persistent socket: authenticate once, then exchange messages.
+
+    Frames are JSON objects. The client sends ``auth`` first, then
+    ``message``, ``resume`` and ``ping`` frames; the server answers with
+    ``ready``, ``chunk``, ``reply``, ``pending``, ``unknown``, ``busy``,
+    ``pong`` and ``error`` frames. Only one message per connection is
+    processed at a time; a new message sent meanwhile gets ``busy`` so the
+    client can retry once the current reply is done, while a re-sent id gets
+    its ``pending`` or ``reply`` frame.
+    """
+    payload = authenticate_socket(ws)
+    if not payload:
+        ws.send(json.dumps({"type": "error", "error": "Invalid or expired token"}))
+        ws.close(reason=1008)
+        return
+
+    user_id = payload['user_id']
+    send_lock = threading.Lock()
+    worker = None
+
+    def send(frame):
+        try:
+            with send_lock:
+                ws.send(json.dumps(frame))
+        except Exception:
+            pass  # Client went away; the turn stays resumable
+
+    send({"type": "ready", "session": str(uuid.uuid4())})
+
+    while True:
+        raw = ws.receive(timeout=WS_IDLE_TIMEOUT)
+        if raw is None:
+            break
+
+        if payload['exp'] < time.time():
+            send({"type": "error", "error": "Invalid or expired token"})
+            break
+
+        try:
+            frame = json.loads(raw)
+        except (TypeError, ValueError):
+            send({"type": "error", "error": "Invalid JSON data"})
+            continue
+
+        if not isinstance(frame, dict):
+            send({"type": "error", "error": "Frames must be JSON objects"})
+            continue
+
+        frame_type = frame.get("type")
+        message_id = str(frame.get("id", ""))[:64]
+
+        if frame_type == "ping":
+            send({"type": "pong"})
+
+        elif frame_type == "resume":
+            resume_ids = frame.get("ids")
+            for resume_id in (resume_ids if isinstance(resume_ids, list) else [])[:20]:
+                resume_id = str(resume_id)[:64]
+                turn = lookup_ws_turn(user_id, resume_id)
+                if turn is None:
+                    send({"type": "unknown", "id": resume_id})
+                elif turn["status"] == "pending":
+                    send({"type": "pending", "id": resume_id})
+                else:
+                    send({"type": "reply", "id": resume_id, "reply": turn["reply"]})
+
+        elif frame_type == "message":
+            if not message_id:
+                send({"type": "error", "error": "Message id is required"})
+                continue
+
+            # A re-sent frame (e.g. after reconnecting to another worker) must not
+            # run twice, and is answered from its turn even while another runs
+            if worker is not None and worker.is_alive():
+                existing = lookup_ws_turn(user_id, message_id)
+                if existing is None:
+                    send({"type": "busy", "id": message_id})
+                    continue
+            else:
+                user_message = sanitize_input(frame.get("message", ""))
+                if not user_message:
+                    send({"type": "reply", "id": message_id, "reply": "Hey there! What's on your mind today?"})
+                    continue
+                existing = claim_ws_turn(user_id, message_id)
+
+            if existing is not None:
+                if existing["status"] == "pending":
+                    send({"type": "pending", "id": message_id})
+                else:
+                    send({"type": "reply", "id": message_id, "reply": existing["reply"]})
+                continue
+
+            worker = threading.Thread(
+                target=run_ws_turn,
+                args=(send, user_id, message_id, user_message),
+                daemon=True
             )
-            logger.info(f"Successfully stored summary for user {user_id}")
+            worker.start()
+
+        else:
+            send({"type": "error", "error": "Unknown frame type"})
+
+# --- Readiness ---
 
+# Latest probe results, replaced wholesale by the prober so reads need no lock
+_readiness = {"status": "starting", "checked_at": None, "checks": {}}
+_prober_started = False
+_prober_lock = threading.Lock()
+
+def probe_dependency(check, slow_ms):
+    """Time one dependency check and classify it as ok, slow or down."""
+    started = time.perf_counter()
+    try:
+        check()
+        latency_ms = (time.perf_counter() - started) * 1000
+        return {"status": "slow" if latency_ms > slow_ms else "ok", "latency_ms": round(latency_ms, 1)}
     except Exception as e:
-        logger.error(f"Summary generation error: {str(e)}")
+        latency_ms = (time.perf_counter() - started) * 1000
+        return {"status": "down", "latency_ms": round(latency_ms, 1), "error": str(e)[:200]}
+
+def check_supabase():
+    supabase.table('invited_users').select('id').limit(1).execute()
+
+def check_openrouter():
+    response = requests.get(
+        OPENROUTER_PROBE_URL,
+        headers={"Authorization": f"Bearer {os.environ.get('OPENROUTER_API_KEY', '')}"},
+        timeout=READINESS_PROBE_TIMEOUT
+    )
+    response.raise_for_status()
+
+def run_readiness_probes():
+    """Probe every dependency once and publish the combined result."""
+    global _readiness
+    checks = {
+        "database": probe_dependency(check_supabase, DB_SLOW_MS),
+        "llm": probe_dependency(check_openrouter, LLM_SLOW_MS)
+    }
+
+    if checks["database"]["status"] == "down":
+        status = "unavailable"  # Nothing works without the database
+    elif any(c["status"] != "ok" for c in checks.values()):
+        status = "degraded"
+    else:
+        status = "ready"
+
+    _readiness = {"status": status, "checked_at": time.time(), "checks": checks}
+
+def readiness_prober_loop():
+    while True:
+        try:
+            run_readiness_probes()
+        except Exception as e:
+            logger.error("Readiness probe failed: %s", e)
+        time.sleep(READINESS_PROBE_INTERVAL)
+
+def start_readiness_prober():
+    """Start the background prober once per process."""
+    global _prober_started
+    with _prober_lock:
+        if _prober_started:
+            return
+        _prober_started = True
+    threading.Thread(target=readiness_prober_loop, daemon=True).start()
+
+@app.route('/ready')
+def readiness_check():
+    """Readiness endpoint for load balancers, served from cached probe results."""
+    start_readiness_prober()
+    snapshot = _readiness
+
+    checked_at = snapshot["checked_at"]
+    stale = checked_at is None or time.time() - checked_at > READINESS_PROBE_INTERVAL * 3
+    status = "starting" if checked_at is None else ("stale" if stale else snapshot["status"])
+
+    body = {
+        "status": status,
+        "checked_at": checked_at,
+        "checks": snapshot["checks"]
+    }
+    return jsonify(body), 200 if status in ("ready", "degraded") else 503
+
+# --- Profiling ---
+
+# Profiles are written to PROFILE_DIR as <profile_id>.json (the pyinstrument
+# session) plus <profile_id>.meta.json, so any worker can list and serve them
+PROFILE_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+_profiles_lock = threading.Lock()
+
+def running_under_gevent():
+    """Whether gevent has patched threading (greenlets share one OS thread)."""
+    try:
+        from gevent import monkey
+        return monkey.is_module_patched('threading')
+    except ImportError:
+        return False
+
+# pyinstrument samples the OS thread, so under gevent a profile also contains
+# the stacks of whichever other greenlets ran during the request
+PROFILE_SHARED_THREAD = running_under_gevent()
+
+def save_profile(profile_id, session, meta):
+    """Write a profile and its metadata, then drop the oldest beyond PROFILE_MAX_STORED."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile_id)
+    session.save(base + '.json')
+    with open(base + '.meta.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(base + '.meta.json.tmp', base + '.meta.json')
+
+    with _profiles_lock:
+        metas = sorted(
+            (name for name in os.listdir(PROFILE_DIR) if name.endswith('.meta.json')),
+            key=lambda name: os.path.getmtime(os.path.join(PROFILE_DIR, name))
+        )
+        for name in metas[:max(0, len(metas) - PROFILE_MAX_STORED)]:
+            old_base = os.path.join(PROFILE_DIR, name[:-len('.meta.json')])
+            for path in (old_base + '.meta.json', old_base + '.json'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+def list_saved_profiles():
+    """Metadata of stored profiles, newest first."""
+    profiles = []
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return profiles
+    for name in names:
+        if not name.endswith('.meta.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name), 'r', encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Pruned or half-written by another worker
+    return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+def is_admin_request():
+    """Whether the request carries a valid token for an ADMIN_EMAILS account."""
+    user, error = get_user_from_token(request.headers.get("Authorization"))
+    return not error and user['email'].lower() in ADMIN_EMAILS
+
+def should_profile_request():
+    """Profile API requests on admin request (X-Profile: 1) or by sampling."""
+    if Profiler is None or not request.path.startswith('/api/') or request.path.startswith('/api/admin/'):
+        return False
+    if request.headers.get('X-Profile') == '1' and is_admin_request():
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+@app.before_request
+def start_request():
+    """Assign a request id and start the profiler for profiled requests."""
+    incoming_id = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming_id if re.fullmatch(r'[A-Za-z0-9_-]{1,64}', incoming_id) else uuid.uuid4().hex
+    g.profiler = None
+    g.started_at = time.perf_counter()
+
+    if should_profile_request():
+        g.profiler = Profiler(interval=PROFILE_INTERVAL, async_mode='disabled')
+        g.profiler.start()
+
+@app.after_request
+def finish_request(response):
+    """Stop the profiler and store the session under a server-generated profile id."""
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    # Stands in for gunicorn's access log (disabled in gunicorn.conf.py)
+    logger.info("%s %s %s", request.method, request.path, response.status_code, extra={
+        "status": response.status_code,
+        "duration_ms": elapsed_ms(g.started_at) if 'started_at' in g else None
+    })
+
+    profiler = g.get('profiler')
+    if profiler is None:
+        return response
+
+    g.profiler = None
+    try:
+        session = profiler.stop()
+        profile_id = uuid.uuid4().hex
+        save_profile(profile_id, session, {
+            "profile_id": profile_id,
+            "request_id": g.request_id,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(session.duration * 1000, 1),
+            "created_at": time.time(),
+            "shared_thread": PROFILE_SHARED_THREAD
+        })
+        response.headers['X-Profile-ID'] = profile_id
+    except Exception as e:
+        logger.warning("Could not store profile: %s", e)
+    return response
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """List recently captured request profiles (admin only)."""
+    if not is_admin_request():
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({"profiles": list_saved_profiles()})
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download one profile as a pyinstrument HTML flamegraph or speedscope JSON (admin only)."""
+    if not is_admin_request():
+        return jsonify({"error": "Admin access required"}), 403
+
+    if not PROFILE_ID_PATTERN.fullmatch(profile_id):
+        return jsonify({"error": "Profile not found"}), 404
+    try:
+        session = Session.load(os.path.join(PROFILE_DIR, profile_id + '.json'))
+    except (FileNotFoundError, ValueError):
+        return jsonify({"error": "Profile not found"}), 404
+
+    if request.args.get('format') == 'speedscope':
+        body = SpeedscopeRenderer().render(session)
+        return Response(body, mimetype='application/json', headers={
+            "Content-Disposition": f'attachment; filename="profile-{profile_id}.speedscope.json"'
+        })
+    return Response(HTMLRenderer().render(session), mimetype='text/html')
 
 # --- Frontend Routes ---
+def render_cached_page(template_name):
+    """Render a static template once and serve it from memory afterwards."""
+    if app.debug:
+        return render_template(template_name)
+
+    html = _page_cache.get(template_name)
+    if html is None:
+        html = render_template(template_name)
+        _page_cache[template_name] = html
+    return html
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_cached_page('index.html')
 
 @app.route('/chat')
 def chat():
-    return render_template('chat.html')
+    return render_cached_page('chat.html')
+
+@app.route('/static/dist/<path:filename>')
+def static_dist(filename):
+    """Serve fingerprinted assets, preferring precompressed variants."""
+    if filename.endswith(('.gz', '.br')) or filename == 'manifest.json':
+        abort(404)
+
+    accepted = request.headers.get('Accept-Encoding', '')
+    encoding = None
+    served_name = filename
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in accepted and os.path.isfile(os.path.join(STATIC_DIST_DIR, filename + suffix)):
+            encoding = candidate
+            served_name = filename + suffix
+            break
+
+    response = send_from_directory(STATIC_DIST_DIR, served_name, max_age=31536000)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        response.mimetype = 'text/css' if filename.endswith('.css') else 'text/javascript'
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 @app.route('/health')
 def health_check():
@@ -408,16 +1341,19 @@ def not_found(error):
 
 @app.errorhandler(500)
 def internal_error(error):
-    logger.error(f"Internal server error: {str(error)}")
+    logger.error("Internal server error: %s", error)
     return jsonify({"error": "Internal server error"}), 500
 
 # Initialize tables on startup
 try:
     ensure_tables_exist()
 except Exception as e:
-    logger.warning(f"Could not verify tables on startup: {str(e)}")
+    logger.warning("Could not verify tables on startup: %s", e)
+
+start_readiness_prober()
+start_partition_maintainer()
 
 if __name__ == '__main__':
-    # Only run in debug mode locally
+    # Development server only; production uses `gunicorn -c gunicorn.conf.py app:app`
     debug_mode = os.environ.get('FLASK_ENV') == 'development'
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=debug_mode)
\ No newline at end of file
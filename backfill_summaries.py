@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Summary Backfill Script for Daddy John Chatbot
+Regenerates conversation summaries for users whose message count has
+outrun their latest summary.
+
+    python backfill_summaries.py --concurrency 8
+    python backfill_summaries.py --min-unsummarized 40 --limit 500
+    python backfill_summaries.py --dry-run
+
+Progress is checkpointed after every user, so an interrupted run (Ctrl+C)
+resumes where it left off when started again. A run that completes marks
+its checkpoint finished, and the next run starts fresh. Use --reset to
+start over after an interruption.
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from llm_client import SUMMARY_HISTORY_SIZE, configure_usage, flush_llm_usage, generate_summary
+from sqlite_store import SQLiteClient
+
+# Load environment variables
+load_dotenv()
+
+if os.environ.get("STORAGE_BACKEND", "supabase").lower() == "sqlite":
+    # Embedded database shared with app.py
+    supabase = SQLiteClient(os.environ.get("SQLITE_PATH", "daddy_john.db"))
+else:
+    # Initialize Supabase
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+
+    if not url or not key:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables (or set STORAGE_BACKEND=sqlite)")
+
+    supabase: Client = create_client(url, key)
+
+# Summary calls are recorded in llm_usage like the app's
+configure_usage(supabase)
+
+USERS_PAGE_SIZE = 1000  # Qualifying users fetched per users_needing_summary call
+
+def new_checkpoint() -> dict:
+    return {"done": set(), "failed": set(), "finished": False}
+
+def load_checkpoint(path: str) -> dict:
+    """Load the user ids handled by a previous run."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {"done": set(data.get("done", [])), "failed": set(data.get("failed", [])), "finished": data.get("finished", False)}
+    except FileNotFoundError:
+        return new_checkpoint()
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """Atomically write the checkpoint file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "done": sorted(checkpoint["done"]),
+            "failed": sorted(checkpoint["failed"]),
+            "finished": checkpoint["finished"],
+            "updated_at": datetime.utcnow().isoformat() + "Z"
+        }, f)
+    os.replace(tmp_path, path)
+
+def find_users(min_unsummarized: int, page_size: int = USERS_PAGE_SIZE):
+    """Users with at least min_unsummarized messages newer than their latest summary."""
+    users = []
+    while True:
+        rows = supabase.rpc('users_needing_summary', {
+            "p_min_unsummarized": min_unsummarized,
+            "p_limit": page_size,
+            "p_offset": len(users)
+        }).execute().data or []
+
+        # PostgREST caps each response at db-max-rows, which may be below
+        # page_size, so a short page does not mean the end; only an empty one does
+        if not rows:
+            return users
+        users.extend(rows)
+
+def backfill_user(user_id: str):
+    """Summarize one user's recent history and store it."""
+    history = supabase.table('messages').select('role, content').eq('user_id', user_id).order('created_at', desc=True).limit(SUMMARY_HISTORY_SIZE).execute().data
+    if not history:
+        return None
+
+    summary_text = generate_summary(list(reversed(history)), timeout=60, user_id=user_id)
+    if not summary_text:
+        raise ValueError("Summary request failed")
+
+    supabase.table('summaries').insert({"user_id": user_id, "summary_text": summary_text}).execute()
+    supabase.table('conversation_state').upsert({"user_id": user_id, "latest_summary": summary_text}).execute()
+    return summary_text
+
+def run_backfill(users, concurrency: int, checkpoint: dict, checkpoint_path: str):
+    """Summarize users in parallel, checkpointing after each one."""
+    lock = threading.Lock()
+    started = time.time()
+    completed = 0
+    failed = 0
+    total = len(users)
+
+    def report():
+        elapsed = time.time() - started
+        rate = completed / elapsed if elapsed else 0.0
+        remaining = (total - completed - failed) / rate if rate else 0.0
+        print(f"⏳ {completed + failed}/{total} processed ({completed} ok, {failed} failed) | {rate * 60:.1f} users/min | ETA {remaining:.0f}s")
+
+    def record(future):
+        # Runs as each user finishes, including users still in flight during an interrupt
+        nonlocal completed, failed
+        if future.cancelled():
+            return
+        user_id = futures[future]
+        error = future.exception()
+        with lock:
+            if error is None:
+                completed += 1
+                checkpoint["done"].add(user_id)
+                checkpoint["failed"].discard(user_id)
+            else:
+                failed += 1
+                checkpoint["failed"].add(user_id)
+            save_checkpoint(checkpoint_path, checkpoint)
+            if error is not None:
+                print(f"❌ User {user_id}: {str(error)}")
+            if (completed + failed) % 10 == 0:
+                report()
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = {executor.submit(backfill_user, u['user_id']): u['user_id'] for u in users}
+    for future in futures:
+        future.add_done_callback(record)
+
+    try:
+        wait(futures)
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted, waiting for in-flight users to finish...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        print(f"💾 Progress saved to {checkpoint_path}; run again to resume.")
+        raise SystemExit(130)
+
+    executor.shutdown(wait=True)
+    elapsed = time.time() - started
+    print("-" * 50)
+    print(f"✅ Summarized {completed} users ({failed} failed) in {elapsed:.1f}s")
+    if elapsed:
+        print(f"📈 Throughput: {completed / elapsed * 60:.1f} users/min")
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate summaries for users whose history has outrun their latest summary.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Users summarized in parallel (default 4)")
+    parser.add_argument("--min-unsummarized", type=int, default=20, help="Messages since the last summary needed to qualify (default 20)")
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many users")
+    parser.add_argument("--checkpoint", default=".backfill_checkpoint.json", help="Checkpoint file path")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry users that failed in the interrupted run being resumed")
+    parser.add_argument("--reset", action="store_true", help="Ignore and overwrite an existing checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="List qualifying users without summarizing")
+    args = parser.parse_args()
+
+    print("🤖 Daddy John Chatbot - Summary Backfill")
+    print("=" * 40)
+
+    checkpoint = new_checkpoint() if args.reset else load_checkpoint(args.checkpoint)
+    if checkpoint["finished"]:
+        # The previous run completed; users it summarized only qualify again with new messages
+        print("🔄 Previous run finished, starting a new one")
+        checkpoint = new_checkpoint()
+    candidates = find_users(args.min_unsummarized)
+
+    skip = set(checkpoint["done"])
+    if not args.retry_failed:
+        skip |= checkpoint["failed"]
+    users = [u for u in candidates if u['user_id'] not in skip]
+    if args.limit is not None:
+        users = users[:args.limit]
+
+    print(f"📋 {len(candidates)} users qualify, {len(candidates) - len(users)} skipped from checkpoint, {len(users)} to process")
+
+    if args.dry_run:
+        for u in users:
+            print(f"User: {u['user_id']}  Messages: {u['total_messages']}  Unsummarized: {u['unsummarized_messages']}")
+        return
+
+    if users:
+        run_backfill(users, max(1, args.concurrency), checkpoint, args.checkpoint)
+        flush_llm_usage()
+
+    checkpoint["finished"] = True
+    save_checkpoint(args.checkpoint, checkpoint)
+
+if __name__ == "__main__":
+    main()
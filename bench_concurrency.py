@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Concurrency Benchmark for Daddy John Chatbot
+Measures how many slow chat requests the app can hold in flight at once.
+
+A local stub stands in for both OpenRouter (replying after --upstream-delay
+seconds) and Supabase (replying immediately), so the numbers reflect the
+serving model rather than network conditions. The app is started once per
+server mode and hit with --concurrency simultaneous POST /api/chat requests.
+With --storage sqlite the app uses a throwaway embedded database instead of
+the Supabase stub, and gunicorn modes run the single threaded worker that
+gunicorn.conf.py configures for SQLite (gevent is not supported there).
+
+    python bench_concurrency.py                      # compare dev server, sync and gevent
+    python bench_concurrency.py --modes gevent --concurrency 2000
+
+With a thread- or process-per-request model the wall time grows in steps of
+the upstream delay once concurrency exceeds the worker count; with gevent
+workers it stays close to a single upstream delay.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import argparse
+import statistics
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import requests
+
+JWT_SECRET = "bench-secret"
+SERVER_MODES = {
+    # The previous entry point: Flask's threaded development server
+    "dev": [sys.executable, "app.py"],
+    # Thread-bound baseline: each request holds a worker until OpenRouter answers
+    "sync": ["gunicorn", "-c", "gunicorn.conf.py", "-k", "sync", "-w", "4", "app:app"],
+    "gthread": ["gunicorn", "-c", "gunicorn.conf.py", "-k", "gthread", "-w", "4", "--threads", "8", "app:app"],
+    # Cooperative I/O workers
+    "gevent": ["gunicorn", "-c", "gunicorn.conf.py", "-k", "gevent", "-w", "4", "app:app"],
+}
+
+def free_port() -> int:
+    """Ask the OS for an unused local port."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_stub(port: int, upstream_delay: float):
+    """Serve fake OpenRouter and Supabase endpoints on a background thread."""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._reply(200, [])
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            if self.path.startswith("/api/v1/chat/completions"):
+                time.sleep(upstream_delay)
+                self._reply(200, {"choices": [{"message": {"content": "Hey there, kiddo."}}]})
+            else:
+                self._reply(201, [])
+
+        do_PATCH = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 4096
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def wait_for_app(base_url: str, timeout: float = 30):
+    """Poll /health until the app answers."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+def run_load(base_url: str, concurrency: int):
+    """Fire `concurrency` chat requests at once and collect latencies."""
+    token = jwt.encode(
+        {"user_id": "00000000-0000-0000-0000-000000000000", "email": "bench@example.com", "exp": int(time.time()) + 3600},
+        JWT_SECRET,
+        algorithm="HS256"
+    )
+    start_gate = threading.Barrier(concurrency)
+
+    def one_request(_):
+        session = requests.Session()
+        start_gate.wait()
+        started = time.perf_counter()
+        try:
+            response = session.post(
+                f"{base_url}/api/chat",
+                headers={"Authorization": f"Bearer {token}"},
+                json={"message": "hello"},
+                timeout=300
+            )
+            ok = response.ok
+        except requests.exceptions.RequestException:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_request, range(concurrency)))
+    wall = time.perf_counter() - wall_start
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    return {
+        "ok": len(latencies),
+        "failed": len(results) - len(latencies),
+        "wall_s": wall,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "p50_s": statistics.median(latencies) if latencies else None,
+        "p95_s": latencies[int(len(latencies) * 0.95) - 1] if latencies else None,
+    }
+
+def bench_mode(mode: str, concurrency: int, stub_port: int, storage: str = "supabase"):
+    """Start the app in one server mode, load it, and stop it."""
+    app_port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(app_port),
+        SUPABASE_URL=f"http://127.0.0.1:{stub_port}",
+        SUPABASE_KEY="bench.bench.bench",
+        OPENROUTER_API_KEY="bench",
+        OPENROUTER_API_URL=f"http://127.0.0.1:{stub_port}/api/v1/chat/completions",
+        JWT_SECRET_KEY=JWT_SECRET,
+        STORAGE_BACKEND=storage,
+    )
+    db_dir = tempfile.TemporaryDirectory() if storage == "sqlite" else None
+    if db_dir:
+        env["SQLITE_PATH"] = os.path.join(db_dir.name, "bench.db")
+    command = SERVER_MODES[mode]
+    if storage == "sqlite" and mode != "dev":
+        # Let gunicorn.conf.py size the worker: one process, GUNICORN_THREADS threads
+        command = ["gunicorn", "-c", "gunicorn.conf.py", "-k", mode, "app:app"]
+    process = subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        base_url = f"http://127.0.0.1:{app_port}"
+        if not wait_for_app(base_url):
+            raise RuntimeError(f"{mode} server did not start")
+        return run_load(base_url, concurrency)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        if db_dir:
+            db_dir.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare concurrent-request capacity across server modes.")
+    parser.add_argument("--modes", nargs="+", default=None, choices=sorted(SERVER_MODES), help="Default: dev sync gevent (dev gthread with --storage sqlite)")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--storage", default="supabase", choices=["supabase", "sqlite"], help="Database backend the app runs against")
+    parser.add_argument("--upstream-delay", type=float, default=2.0, help="Seconds the fake OpenRouter takes to reply")
+    args = parser.parse_args()
+    if args.modes is None:
+        args.modes = ["dev", "gthread"] if args.storage == "sqlite" else ["dev", "sync", "gevent"]
+    if args.storage == "sqlite" and "gevent" in args.modes:
+        parser.error("SQLite storage runs on OS threads; use the dev, sync or gthread modes")
+
+    stub_port = free_port()
+    stub = start_stub(stub_port, args.upstream_delay)
+
+    print(f"📊 {args.concurrency} concurrent chats, upstream delay {args.upstream_delay}s, {args.storage} storage")
+    print(f"{'mode':<10}{'ok':>6}{'failed':>8}{'wall s':>10}{'req/s':>10}{'p50 s':>10}{'p95 s':>10}")
+    try:
+        for mode in args.modes:
+            r = bench_mode(mode, args.concurrency, stub_port, args.storage)
+            p50 = f"{r['p50_s']:.2f}" if r['p50_s'] is not None else "-"
+            p95 = f"{r['p95_s']:.2f}" if r['p95_s'] is not None else "-"
+            print(f"{mode:<10}{r['ok']:>6}{r['failed']:>8}{r['wall_s']:>10.2f}{r['throughput_rps']:>10.1f}{p50:>10}{p95:>10}")
+    finally:
+        stub.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main())
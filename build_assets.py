@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Static Asset Build Script for Daddy John Chatbot
+Minifies, content-hashes and precompresses the files in static/ so they can
+be served with immutable caching. Run before deploying:
+
+    python build_assets.py
+"""
+
+import os
+import re
+import json
+import gzip
+import hashlib
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+ASSETS = ['styles.css', 'auth.js', 'chat.js']
+
+def minify_css(source: str) -> str:
+    """Strip comments and collapse whitespace in a stylesheet."""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+    source = source.replace(';}', '}')
+    return source.strip()
+
+def minify_js(source: str) -> str:
+    """Conservatively minify a script: drop indentation, blank lines and whole-line comments."""
+    lines = []
+    for line in source.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('//'):
+            continue
+        lines.append(stripped)
+    return '\n'.join(lines) + '\n'
+
+def fingerprint(content: bytes) -> str:
+    """Return a short content hash used in the output filename."""
+    return hashlib.sha256(content).hexdigest()[:12]
+
+def write_variants(path: str, content: bytes):
+    """Write the asset plus gzip and (when available) brotli variants."""
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+def build():
+    """Build all assets into static/dist and write the manifest."""
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+
+    manifest = {}
+    total_in = 0
+    total_out = 0
+
+    for name in ASSETS:
+        with open(os.path.join(STATIC_DIR, name), 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        root, ext = os.path.splitext(name)
+        minified = minify_css(source) if ext == '.css' else minify_js(source)
+        content = minified.encode('utf-8')
+
+        hashed_name = f"{root}.{fingerprint(content)}{ext}"
+        write_variants(os.path.join(DIST_DIR, hashed_name), content)
+        manifest[name] = f"dist/{hashed_name}"
+
+        total_in += len(source.encode('utf-8'))
+        total_out += len(content)
+        print(f"✅ {name} -> dist/{hashed_name} ({len(content)} bytes)")
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    if brotli is None:
+        print("⚠️  brotli not installed, skipped .br variants (pip install brotli)")
+    print(f"📦 {len(manifest)} assets built: {total_in} -> {total_out} bytes")
+
+if __name__ == "__main__":
+    build()
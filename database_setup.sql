@@ -76,9 +76,335 @@ CREATE POLICY "Users can insert own summaries" ON summaries
 -- GRANT ALL ON messages TO service_role;
 -- GRANT ALL ON summaries TO service_role;
 
+-- 11. Create conversation_state table (one row per user, read with a single primary-key lookup)
+CREATE TABLE IF NOT EXISTS conversation_state (
+    user_id UUID PRIMARY KEY,
+    latest_summary TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    recent_messages JSONB NOT NULL DEFAULT '[]'::jsonb,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE conversation_state ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own conversation state" ON conversation_state
+    FOR SELECT USING (true); -- Adjust based on your auth system
+
+CREATE POLICY "Users can upsert own conversation state" ON conversation_state
+    FOR ALL USING (true) WITH CHECK (true); -- Adjust based on your auth system
+
+-- Keep only the last p_limit elements of a JSONB array
+CREATE OR REPLACE FUNCTION jsonb_array_tail(p_items JSONB, p_limit INTEGER)
+RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_agg(t.item ORDER BY t.idx), '[]'::jsonb)
+    FROM (
+        SELECT item, idx
+        FROM jsonb_array_elements(COALESCE(p_items, '[]'::jsonb)) WITH ORDINALITY AS e(item, idx)
+        ORDER BY idx DESC
+        LIMIT p_limit
+    ) t;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Atomically append the messages of one chat turn to a user's snapshot
+CREATE OR REPLACE FUNCTION record_conversation_turn(p_user_id UUID, p_messages JSONB, p_max_recent INTEGER DEFAULT 20)
+RETURNS conversation_state AS $$
+    INSERT INTO conversation_state AS cs (user_id, message_count, recent_messages, updated_at)
+    VALUES (p_user_id, jsonb_array_length(p_messages), jsonb_array_tail(p_messages, p_max_recent), NOW())
+    ON CONFLICT (user_id) DO UPDATE SET
+        message_count = cs.message_count + jsonb_array_length(p_messages),
+        recent_messages = jsonb_array_tail(cs.recent_messages || p_messages, p_max_recent),
+        updated_at = NOW()
+    RETURNING *;
+$$ LANGUAGE sql;
+
+-- Backfill snapshots for users who already have history (safe to re-run)
+INSERT INTO conversation_state (user_id, latest_summary, message_count, recent_messages)
+SELECT
+    m.user_id,
+    (SELECT s.summary_text FROM summaries s WHERE s.user_id = m.user_id ORDER BY s.created_at DESC LIMIT 1),
+    COUNT(*),
+    (SELECT COALESCE(jsonb_agg(jsonb_build_object('role', r.role, 'content', r.content) ORDER BY r.created_at), '[]'::jsonb)
+     FROM (SELECT role, content, created_at FROM messages WHERE user_id = m.user_id ORDER BY created_at DESC LIMIT 20) r)
+FROM messages m
+GROUP BY m.user_id
+ON CONFLICT (user_id) DO NOTHING;
+
+-- 12. Composite index for per-user, time-ordered reads (recent history, export pagination)
+CREATE INDEX IF NOT EXISTS idx_messages_user_created_id ON messages(user_id, created_at, id);
+
+-- 13. Create llm_usage table (one row per OpenRouter call, inserted in batches)
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID,
+    kind VARCHAR(20) NOT NULL,  -- 'chat' or 'summary'
+    model TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL,  -- 'ok', 'timeout', 'error', 'deadline'
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    cost NUMERIC(12, 6) NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_usage_user_created ON llm_usage(user_id, created_at);
+
+ALTER TABLE llm_usage ENABLE ROW LEVEL SECURITY;
+
+-- Per-user daily rollups for admin tooling and quotas
+CREATE OR REPLACE VIEW llm_usage_daily AS
+SELECT
+    u.user_id,
+    iu.email,
+    (u.created_at AT TIME ZONE 'UTC')::date AS day,
+    COUNT(*) AS calls,
+    COUNT(*) FILTER (WHERE u.status <> 'ok') AS failed_calls,
+    SUM(u.prompt_tokens) AS prompt_tokens,
+    SUM(u.completion_tokens) AS completion_tokens,
+    SUM(u.total_tokens) AS total_tokens,
+    SUM(u.cost) AS cost,
+    ROUND(AVG(u.latency_ms)::numeric, 1) AS avg_latency_ms,
+    SUM(u.retries) AS retries
+FROM llm_usage u
+LEFT JOIN invited_users iu ON iu.id = u.user_id
+GROUP BY u.user_id, iu.email, (u.created_at AT TIME ZONE 'UTC')::date;
+
+-- 14. Partition messages by month (migration, safe to re-run)
+-- Converts messages into a table range-partitioned on created_at with one
+-- partition per month, a default partition as a safety net (its rows are moved
+-- out when their month's partition is created), and a composite
+-- (user_id, created_at, id) index inherited by every partition. Queries and
+-- inserts from the app are unchanged. The previous table is kept as
+-- messages_unpartitioned until you drop it.
+
+-- Create the partition holding the given month, if missing. Rows for that
+-- month that already landed in messages_default are moved into it first;
+-- otherwise Postgres refuses the new partition because the default
+-- partition would then hold rows that belong to it.
+-- Partition DDL requires owning messages, which the app's service_role key
+-- does not, so the partition functions run as their owner (SECURITY DEFINER)
+-- and only service_role may call them (see the REVOKE below).
+CREATE OR REPLACE FUNCTION create_messages_partition(p_month DATE)
+RETURNS TEXT
+SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+    v_start DATE := date_trunc('month', p_month)::date;
+    v_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+    v_name TEXT := 'messages_' || to_char(v_start, 'YYYY_MM');
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    IF to_regclass('messages_default') IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            v_name, v_start, v_end
+        );
+        RETURN v_name;
+    END IF;
+
+    -- Block inserts into the default partition until the new one is attached
+    LOCK TABLE messages_default IN ACCESS EXCLUSIVE MODE;
+    EXECUTE format('CREATE TABLE %I (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', v_name);
+    EXECUTE format(
+        'WITH moved AS (
+             DELETE FROM messages_default WHERE created_at >= %L AND created_at < %L
+             RETURNING id, user_id, role, content, created_at
+         )
+         INSERT INTO %I (id, user_id, role, content, created_at) SELECT * FROM moved',
+        v_start, v_end, v_name
+    );
+    EXECUTE format(
+        'ALTER TABLE messages ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_start, v_end
+    );
+    RETURN v_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Make sure partitions exist from the current month through p_months_ahead months out
+CREATE OR REPLACE FUNCTION ensure_messages_partitions(p_months_ahead INTEGER DEFAULT 3)
+RETURNS VOID
+SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+    i INTEGER;
+BEGIN
+    FOR i IN 0..p_months_ahead LOOP
+        PERFORM create_messages_partition((date_trunc('month', NOW()) + make_interval(months => i))::date);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep PostgREST clients from triggering DDL and ACCESS EXCLUSIVE locks
+REVOKE EXECUTE ON FUNCTION create_messages_partition(DATE) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION ensure_messages_partitions(INTEGER) FROM PUBLIC;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+        REVOKE EXECUTE ON FUNCTION create_messages_partition(DATE) FROM anon, authenticated;
+        REVOKE EXECUTE ON FUNCTION ensure_messages_partitions(INTEGER) FROM anon, authenticated;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'service_role') THEN
+        GRANT EXECUTE ON FUNCTION create_messages_partition(DATE) TO service_role;
+        GRANT EXECUTE ON FUNCTION ensure_messages_partitions(INTEGER) TO service_role;
+    END IF;
+END;
+$$;
+
+DO $$
+DECLARE
+    v_month DATE;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'messages'
+    ) THEN
+        RAISE NOTICE 'messages is already partitioned';
+        RETURN;
+    END IF;
+
+    ALTER TABLE messages RENAME TO messages_unpartitioned;
+    ALTER INDEX IF EXISTS idx_messages_user_created_id RENAME TO idx_messages_unpartitioned_user_created_id;
+
+    CREATE TABLE messages (
+        id UUID DEFAULT gen_random_uuid(),
+        user_id UUID NOT NULL,
+        role VARCHAR(20) NOT NULL CHECK (role IN ('user', 'assistant', 'system')),
+        content TEXT NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+    -- Partitions for every month that already has data, plus the months ahead
+    FOR v_month IN
+        SELECT DISTINCT date_trunc('month', created_at)::date FROM messages_unpartitioned WHERE created_at IS NOT NULL
+    LOOP
+        PERFORM create_messages_partition(v_month);
+    END LOOP;
+    PERFORM ensure_messages_partitions(3);
+
+    -- Per-user recent-history reads and export pagination (the section 12 index)
+    CREATE INDEX idx_messages_user_created_id ON messages (user_id, created_at, id);
+
+    INSERT INTO messages (id, user_id, role, content, created_at)
+    SELECT id, user_id, role, content, COALESCE(created_at, NOW()) FROM messages_unpartitioned;
+
+    ALTER TABLE messages ENABLE ROW LEVEL SECURITY;
+    CREATE POLICY "Users can view own messages" ON messages
+        FOR SELECT USING (true); -- Adjust based on your auth system
+    CREATE POLICY "Users can insert own messages" ON messages
+        FOR INSERT WITH CHECK (true); -- Adjust based on your auth system
+END;
+$$;
+
+-- Create upcoming partitions monthly when pg_cron is available (the app also
+-- calls ensure_messages_partitions() on startup and every few hours)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('ensure-messages-partitions', '0 0 1 * *', 'SELECT ensure_messages_partitions(3)');
+    END IF;
+END;
+$$;
+
+-- Once the migration is verified:
+-- DROP TABLE messages_unpartitioned;
+
+-- 15. Track prompt-cache hits and time to first token in llm_usage
+ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS cached_tokens INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS ttft_ms REAL;
+
+CREATE OR REPLACE VIEW llm_usage_daily AS
+SELECT
+    u.user_id,
+    iu.email,
+    (u.created_at AT TIME ZONE 'UTC')::date AS day,
+    COUNT(*) AS calls,
+    COUNT(*) FILTER (WHERE u.status <> 'ok') AS failed_calls,
+    SUM(u.prompt_tokens) AS prompt_tokens,
+    SUM(u.completion_tokens) AS completion_tokens,
+    SUM(u.total_tokens) AS total_tokens,
+    SUM(u.cost) AS cost,
+    ROUND(AVG(u.latency_ms)::numeric, 1) AS avg_latency_ms,
+    SUM(u.retries) AS retries,
+    SUM(u.cached_tokens) AS cached_tokens,
+    ROUND(AVG(u.ttft_ms)::numeric, 1) AS avg_ttft_ms
+FROM llm_usage u
+LEFT JOIN invited_users iu ON iu.id = u.user_id
+GROUP BY u.user_id, iu.email, (u.created_at AT TIME ZONE 'UTC')::date;
+
+-- 16. Users whose history has outrun their latest summary (used by backfill_summaries.py)
+-- Paged with p_limit/p_offset, since PostgREST caps each response at db-max-rows
+DROP FUNCTION IF EXISTS users_needing_summary(INTEGER);
+CREATE OR REPLACE FUNCTION users_needing_summary(
+    p_min_unsummarized INTEGER DEFAULT 20,
+    p_limit INTEGER DEFAULT 1000,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS TABLE (user_id UUID, total_messages BIGINT, unsummarized_messages BIGINT)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        m.user_id,
+        COUNT(*) AS total_messages,
+        COUNT(*) FILTER (WHERE s.last_summary_at IS NULL OR m.created_at > s.last_summary_at) AS unsummarized_messages
+    FROM messages m
+    LEFT JOIN (
+        SELECT summaries.user_id, MAX(summaries.created_at) AS last_summary_at
+        FROM summaries
+        GROUP BY summaries.user_id
+    ) s ON s.user_id = m.user_id
+    GROUP BY m.user_id
+    HAVING COUNT(*) FILTER (WHERE s.last_summary_at IS NULL OR m.created_at > s.last_summary_at) >= p_min_unsummarized
+    ORDER BY unsummarized_messages DESC, m.user_id
+    LIMIT p_limit OFFSET p_offset;
+$$;
+
+-- 17. WebSocket turn state (lets a client resume or re-send a turn on any worker)
+CREATE TABLE IF NOT EXISTS ws_turns (
+    user_id UUID NOT NULL,
+    message_id VARCHAR(64) NOT NULL,
+    status VARCHAR(10) NOT NULL,  -- 'pending' or 'done'
+    reply TEXT,
+    started_at DOUBLE PRECISION NOT NULL,  -- Unix time set by the app
+    PRIMARY KEY (user_id, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ws_turns_started_at ON ws_turns(started_at);
+
+ALTER TABLE ws_turns ENABLE ROW LEVEL SECURITY;
+
+-- 18. One keyset page of a user's messages, oldest first (used by the export)
+-- Pass the last row's created_at and id to get the next page; the row-value
+-- comparison is served by the (user_id, created_at, id) index.
+CREATE OR REPLACE FUNCTION messages_page(
+    p_user_id UUID,
+    p_after_created_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 1000
+)
+RETURNS TABLE (id UUID, role VARCHAR, content TEXT, created_at TIMESTAMP WITH TIME ZONE)
+LANGUAGE sql STABLE AS $$
+    SELECT m.id, m.role, m.content, m.created_at
+    FROM messages m
+    WHERE m.user_id = p_user_id
+      AND (m.created_at, m.id) > (
+          COALESCE(p_after_created_at, '-infinity'),
+          COALESCE(p_after_id, '00000000-0000-0000-0000-000000000000')
+      )
+    ORDER BY m.created_at, m.id
+    LIMIT p_limit;
+$$;
+
 -- Verification queries (run these to check if everything is set up correctly)
 -- SELECT 'invited_users' as table_name, count(*) as row_count FROM invited_users
 -- UNION ALL
 -- SELECT 'messages' as table_name, count(*) as row_count FROM messages
 -- UNION ALL
--- SELECT 'summaries' as table_name, count(*) as row_count FROM summaries;
+-- SELECT 'summaries' as table_name, count(*) as row_count FROM summaries
+-- UNION ALL
+-- SELECT 'conversation_state' as table_name, count(*) as row_count FROM conversation_state;
@@ -0,0 +1,78 @@
+"""
+Gunicorn configuration for production serving of Daddy John Chatbot
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Chat requests spend nearly all of their time waiting on OpenRouter and
+Supabase, so workers use gevent: each worker process multiplexes up to
+``worker_connections`` in-flight requests on greenlets instead of parking
+one OS thread per request. Blocking ``requests``/``httpx`` calls become
+cooperative through gevent's monkey-patching, which the worker applies
+before the app is imported.
+
+Sizing:
+- WEB_CONCURRENCY: worker processes, default one per CPU core. Extra
+  processes only help with CPU-bound work (bcrypt, JSON), not waiting.
+- GUNICORN_WORKER_CONNECTIONS: concurrent requests per worker, default
+  1000. Total capacity is roughly workers * worker_connections, bounded by
+  upstream rate limits and file descriptors (ulimit -n).
+- GUNICORN_WORKER_CLASS: override the worker model, e.g. "gthread" or
+  "sync" when comparing with bench_concurrency.py.
+
+With STORAGE_BACKEND=sqlite the app runs as one process of OS threads
+(gthread, GUNICORN_THREADS per worker, default 32) instead. The embedded
+database keeps one connection per OS thread and its calls block, so under
+gevent every greenlet would open its own connection and stall the other
+greenlets while it waits on the file.
+"""
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+if os.environ.get('STORAGE_BACKEND', 'supabase').lower() == 'sqlite':
+    if worker_class not in ('sync', 'gthread'):
+        worker_class = 'gthread'
+    workers = 1
+    threads = int(os.environ.get('GUNICORN_THREADS', 32))  # Each open WebSocket holds one
+
+# With gevent this is the worker heartbeat timeout, not a per-request limit
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth
+max_requests = 10000
+max_requests_jitter = 1000
+
+# The app must be imported after gevent patches sockets, so no preloading
+preload_app = False
+
+# Logs are one JSON stream on stdout (see logging_setup.py). The app logs
+# every request with its status and duration, so gunicorn's plain-text access
+# log is off; its error log uses the app's JSON formatter, and inside workers
+# it is moved onto the app's non-blocking log queue.
+accesslog = None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+logconfig_dict = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "logging_setup.JsonFormatter"}
+    },
+    "handlers": {
+        "stdout": {"class": "logging.StreamHandler", "formatter": "json", "stream": "ext://sys.stdout"}
+    },
+    "loggers": {
+        "gunicorn.error": {"level": loglevel.upper(), "handlers": ["stdout"], "propagate": False},
+        "gunicorn.access": {"level": "CRITICAL", "handlers": [], "propagate": False}
+    },
+    "root": {"level": "INFO", "handlers": []}
+}
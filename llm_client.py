@@ -0,0 +1,355 @@
+"""
+OpenRouter client for Daddy John Chatbot
+Chat completions (plain or streamed) with retries and request deadlines,
+conversation summaries, and per-call usage accounting. Shared by the web
+app and the backfill script so both send the same prompts and both record
+their calls in ``llm_usage``.
+
+Usage rows are buffered in memory and inserted in batches by a background
+flusher once ``configure_usage()`` has given it a database client (a
+Supabase client or ``sqlite_store.SQLiteClient``). Deadlines are duck-typed:
+anything with ``allows()``, ``timeout()`` and ``remaining()`` works.
+"""
+
+import os
+import json
+import time
+import socket
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+import requests
+from dotenv import load_dotenv
+
+# Constants below read the environment at import time
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENROUTER_MODEL = os.environ.get("OPENROUTER_MODEL", "cognitivecomputations/dolphin3.0-r1-mistral-24b:free")
+
+MIN_LLM_BUDGET = 3.0  # Skip an OpenRouter attempt with less time than this left
+RETRY_BACKOFF_SECONDS = 1
+DEADLINE_REPLY = "I'm thinking a bit slowly right now. Can you try asking me again?"
+
+SUMMARY_PROMPT = "Summarize the key points of this conversation in 1-2 sentences. Focus on the user's main concerns, emotional state, and any important context that should be remembered for future conversations."
+SUMMARY_HISTORY_SIZE = 10  # Most recent messages a summary covers
+
+USAGE_FLUSH_SIZE = 50  # Flush buffered usage rows once this many are queued
+USAGE_FLUSH_INTERVAL = 30  # ...or at least this often (seconds)
+USAGE_MAX_BUFFERED = 5000  # Drop the oldest rows beyond this if the database is down
+USAGE_PROBE_ROWS = 3  # After a failed batch, this many rejected rows in a row means the database is down
+
+def elapsed_ms(started: float) -> float:
+    """Milliseconds since a time.perf_counter() reading."""
+    return round((time.perf_counter() - started) * 1000, 1)
+
+class DeadlineExceeded(Exception):
+    """Raised when a streamed reply outlives the request deadline."""
+
+    def __init__(self, partial: str):
+        super().__init__("Request deadline exceeded while streaming")
+        self.partial = partial
+
+def read_openrouter_stream(response, on_chunk, started=None, deadline=None):
+    """Accumulate a streamed (SSE) completion, forwarding each content delta.
+
+    Returns the full content, the usage block from the final event, and the
+    time to first content token in ms (measured from `started`). The
+    `requests` timeout only bounds each socket read, so with a deadline a
+    timer closes the response when it runs out; DeadlineExceeded then
+    carries the content received so far.
+    """
+    parts = []
+    usage = None
+    ttft_ms = None
+    cut_off = threading.Event()
+
+    def cut():
+        cut_off.set()
+        # Closing the response does not wake a blocked read; shutting the socket down does
+        try:
+            response.raw._fp.fp.raw._sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        response.close()
+
+    timer = None
+    if deadline is not None:
+        timer = threading.Timer(deadline.remaining(), cut)
+        timer.daemon = True
+        timer.start()
+
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if cut_off.is_set():
+                break
+            if not line or not line.startswith("data: "):
+                continue  # Skip keep-alive comments and blank lines
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if event.get('usage'):
+                usage = event['usage']
+            if not event.get('choices'):
+                continue
+            delta = event['choices'][0].get('delta', {}).get('content')
+            if delta:
+                if ttft_ms is None and started is not None:
+                    ttft_ms = elapsed_ms(started)
+                parts.append(delta)
+                on_chunk(delta)
+    except Exception:
+        if not cut_off.is_set():
+            raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    if cut_off.is_set():
+        raise DeadlineExceeded("".join(parts))
+    return "".join(parts), usage, ttft_ms
+
+def can_retry(deadline):
+    """Whether the deadline leaves room for a backoff plus another attempt."""
+    return deadline is None or deadline.allows(RETRY_BACKOFF_SECONDS + MIN_LLM_BUDGET)
+
+def request_completion(messages, timeout=25, max_retries=3, on_chunk=None, deadline=None, user_id=None, kind="chat"):
+    """Make a request to OpenRouter API with retry logic.
+
+    Returns (status, content): status is "ok", "timeout", "error" or
+    "deadline", and on failure content is a fallback reply for the user.
+
+    When on_chunk is given the completion is streamed and each content
+    delta is passed to it as it arrives. With a deadline, each attempt only
+    gets the remaining budget and attempts that cannot fit are skipped;
+    callers that store the reply pass a deadline with a write reserve.
+    Token usage, latency and retries are recorded for user_id under kind.
+    """
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        logger.error("OPENROUTER_API_KEY not found in environment variables")
+        return "error", "I'm having trouble connecting to my brain right now, kiddo. Can you try again in a moment?"
+
+    started = time.perf_counter()
+
+    def finish(status, content, attempt, usage=None, ttft_ms=None):
+        # Accounting must never cost the user their reply
+        try:
+            record_llm_usage(user_id, kind, OPENROUTER_MODEL, usage, elapsed_ms(started), attempt, status, ttft_ms)
+        except Exception as e:
+            logger.error("Could not record LLM usage: %s", e)
+        return status, content
+
+    for attempt in range(max_retries):
+        if deadline is not None and not deadline.allows(MIN_LLM_BUDGET):
+            logger.warning("Skipping OpenRouter attempt %s: request deadline exceeded", attempt + 1)
+            return finish("deadline", DEADLINE_REPLY, attempt)
+
+        attempt_timeout = deadline.timeout(timeout) if deadline is not None else timeout
+        try:
+            response = requests.post(
+                url=OPENROUTER_API_URL,
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": os.environ.get("VERCEL_URL", "http://localhost:5000"),
+                    "X-Title": "Daddy John Chatbot"
+                },
+                json={
+                    "model": OPENROUTER_MODEL,
+                    "messages": messages,
+                    "temperature": 0.7,
+                    "stream": on_chunk is not None,
+                    "usage": {"include": True}
+                },
+                timeout=attempt_timeout,
+                stream=on_chunk is not None
+            )
+            response.raise_for_status()
+
+            if on_chunk is not None:
+                content, usage, ttft_ms = read_openrouter_stream(response, on_chunk, started, deadline)
+                if not content:
+                    raise ValueError("Empty streamed response")
+                return finish("ok", content, attempt, usage, ttft_ms)
+
+            result = response.json()
+            if 'choices' not in result or not result['choices']:
+                raise ValueError("Invalid API response format")
+
+            return finish("ok", result['choices'][0]['message']['content'], attempt, result.get('usage'))
+
+        except DeadlineExceeded as e:
+            # Chunks already went to the client, so keep what arrived rather than retrying
+            logger.warning("OpenRouter stream cut off by request deadline on attempt %s", attempt + 1)
+            return finish("deadline", e.partial or DEADLINE_REPLY, attempt)
+        except requests.exceptions.Timeout:
+            logger.warning("OpenRouter API timeout on attempt %s", attempt + 1)
+            if attempt < max_retries - 1 and can_retry(deadline):
+                time.sleep(RETRY_BACKOFF_SECONDS)
+            else:
+                return finish("timeout", DEADLINE_REPLY, attempt)
+        except requests.exceptions.RequestException as e:
+            logger.error("OpenRouter API error on attempt %s: %s", attempt + 1, e)
+            if attempt < max_retries - 1 and can_retry(deadline):
+                time.sleep(RETRY_BACKOFF_SECONDS)
+            else:
+                return finish("error", "I'm having trouble with my thoughts right now. Please try again in a moment.", attempt)
+        except Exception as e:
+            logger.error("Unexpected error in OpenRouter request: %s", e)
+            return finish("error", "Something went wrong in my thinking process. Let me try to help you anyway!", attempt)
+
+def make_openrouter_request(messages, **kwargs):
+    """Reply text from request_completion(), with a fallback reply on failure."""
+    return request_completion(messages, **kwargs)[1]
+
+def generate_summary(history, timeout=30, deadline=None, user_id=None):
+    """Summarize the most recent messages of a conversation.
+
+    Returns None when the call did not succeed, so fallback replies are
+    never stored as summaries.
+    """
+    messages = [{"role": "system", "content": SUMMARY_PROMPT}]
+    messages.extend({"role": m["role"], "content": m["content"]} for m in history[-SUMMARY_HISTORY_SIZE:])
+
+    status, content = request_completion(messages, timeout=timeout, deadline=deadline, user_id=user_id, kind="summary")
+    if status != "ok" or not content or not content.strip():
+        return None
+    return content.strip()
+
+# --- Usage Accounting ---
+
+_usage_client = None
+_usage_buffer = []
+_usage_in_flight = []  # Batches taken from the buffer and not yet written
+_usage_lock = threading.Lock()
+_usage_flusher_started = False
+
+def configure_usage(client):
+    """Set the database client usage rows are flushed to."""
+    global _usage_client
+    _usage_client = client
+
+def usage_number(value):
+    """Providers may send null or omit usage fields; count those as 0."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+def record_llm_usage(user_id, kind, model, usage, latency_ms, retries, status, ttft_ms=None):
+    """Buffer one LLM call's usage for the next batch flush."""
+    usage = usage or {}
+    prompt_tokens = usage_number(usage.get('prompt_tokens'))
+    completion_tokens = usage_number(usage.get('completion_tokens'))
+    row = {
+        "user_id": user_id,
+        "kind": kind,
+        "model": model,
+        "status": status,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": usage_number(usage.get('total_tokens')) or prompt_tokens + completion_tokens,
+        "cached_tokens": usage_number((usage.get('prompt_tokens_details') or {}).get('cached_tokens')),
+        "cost": usage_number(usage.get('cost')),
+        "latency_ms": latency_ms,
+        "ttft_ms": ttft_ms,
+        "retries": retries,
+        "created_at": datetime.utcnow().isoformat() + "Z"
+    }
+
+    with _usage_lock:
+        _usage_buffer.append(row)
+        if len(_usage_buffer) > USAGE_MAX_BUFFERED:
+            del _usage_buffer[:len(_usage_buffer) - USAGE_MAX_BUFFERED]
+        should_flush = len(_usage_buffer) >= USAGE_FLUSH_SIZE
+
+    start_usage_flusher()
+    if should_flush:
+        threading.Thread(target=flush_llm_usage, daemon=True).start()
+
+def pending_usage_tokens(user_id, day):
+    """Tokens recorded for the user on day ("YYYY-MM-DD") that are not in llm_usage yet."""
+    with _usage_lock:
+        pending_rows = _usage_buffer + [row for batch in _usage_in_flight for row in batch]
+    return sum(row["total_tokens"] for row in pending_rows
+               if row["user_id"] == user_id and row["created_at"].startswith(day))
+
+def insert_usage(rows):
+    """Insert usage rows; returns an error message, or None on success."""
+    try:
+        _usage_client.table('llm_usage').insert(rows).execute()
+        return None
+    except Exception as e:
+        logger.error("Database operation failed: %s", e)
+        return str(e)
+
+def insert_usage_rows_individually(rows):
+    """Retry a failed batch row by row so one bad row cannot block the rest.
+
+    Rows rejected while others are accepted are dropped. If the first
+    USAGE_PROBE_ROWS rows all fail the database is treated as unavailable,
+    and the rows not yet written are returned to be re-queued.
+    """
+    rejected = []
+    written = 0
+    for i, row in enumerate(rows):
+        if insert_usage(row) is None:
+            written += 1
+            continue
+        rejected.append(row)
+        if not written and len(rejected) >= USAGE_PROBE_ROWS:
+            return rejected + rows[i + 1:]
+
+    if rejected and written:
+        logger.error("Dropped %s usage rows rejected by the database", len(rejected))
+        return []
+    return rejected
+
+def flush_llm_usage():
+    """Write buffered usage rows to llm_usage in one insert; keep them if the database is down."""
+    if _usage_client is None:
+        return
+
+    with _usage_lock:
+        rows = _usage_buffer[:]
+        del _usage_buffer[:]
+        if rows:
+            _usage_in_flight.append(rows)
+
+    if not rows:
+        return
+
+    retry_rows = []
+    try:
+        if insert_usage(rows) is not None:
+            retry_rows = insert_usage_rows_individually(rows)
+    finally:
+        with _usage_lock:
+            _usage_in_flight.remove(rows)
+            if retry_rows:
+                _usage_buffer[:0] = retry_rows
+                if len(_usage_buffer) > USAGE_MAX_BUFFERED:
+                    del _usage_buffer[:len(_usage_buffer) - USAGE_MAX_BUFFERED]
+
+def usage_flusher_loop():
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL)
+        try:
+            flush_llm_usage()
+        except Exception as e:
+            logger.error("Usage flush failed: %s", e)
+
+def start_usage_flusher():
+    """Start the periodic usage flusher once per process."""
+    global _usage_flusher_started
+    with _usage_lock:
+        if _usage_flusher_started:
+            return
+        _usage_flusher_started = True
+    threading.Thread(target=usage_flusher_loop, daemon=True).start()
+    atexit.register(flush_llm_usage)
@@ -0,0 +1,145 @@
+"""
+Logging setup for Daddy John Chatbot
+Non-blocking, structured (JSON) logging for the request path.
+
+Records are handed to a bounded in-memory queue by the calling thread and
+formatted/written by a background listener, so a slow stdout never stalls a
+request. Messages use lazy %-style arguments and are only rendered by the
+listener. Repeated records from the same call site are rate-limited so an
+upstream outage cannot flood the output. When the queue overflows, records
+are dropped and the count is reported as ``dropped_records`` on the next
+record that gets through. gunicorn's error logger is moved onto the same
+queue, so worker output is one JSON stream.
+"""
+
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request id and user id, when there is a request."""
+
+    def filter(self, record):
+        if has_request_context():
+            if not hasattr(record, 'request_id'):
+                record.request_id = g.get('request_id')
+            if not hasattr(record, 'user_id') and g.get('user_id'):
+                record.user_id = g.get('user_id')
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `burst` records per call site through every `window` seconds.
+
+    Records are keyed by logger, level and the unformatted message template,
+    so the same warning raised with different arguments counts as one source.
+    The first record after a suppressed stretch reports how many were dropped.
+    Only WARNING and above are limited.
+    """
+
+    def __init__(self, burst: int = 5, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._counters.get(key, (now, 0, 0))
+            if now - window_start >= self.window:
+                window_start, count = now, 0
+
+            if count >= self.burst:
+                self._counters[key] = (window_start, count, suppressed + 1)
+                return False
+
+            self._counters[key] = (window_start, count + 1, 0)
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full.
+
+    The number of records dropped since the last successful enqueue is
+    attached to the next record as ``dropped_records``.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Formatting is deferred to the listener thread
+        return record
+
+    def enqueue(self, record):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            record.dropped_records = dropped
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += dropped + 1
+
+def configure_logging(level=logging.INFO, max_queue_size: int = 10000):
+    """Route all logging through a background JSON writer. Returns the listener."""
+    log_queue = queue.Queue(maxsize=max_queue_size)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    # Under gunicorn, send its worker-side error log through the queue too
+    error_log = logging.getLogger('gunicorn.error')
+    if error_log.handlers:
+        error_log.handlers = [queue_handler]
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -6,20 +6,26 @@ Adds new invited users to the database with hashed passwords
 
 import os
 import bcrypt
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from sqlite_store import SQLiteClient
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
+if os.environ.get("STORAGE_BACKEND", "supabase").lower() == "sqlite":
+    # Embedded database shared with app.py
+    supabase = SQLiteClient(os.environ.get("SQLITE_PATH", "daddy_john.db"))
+else:
+    # Initialize Supabase
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
 
-if not url or not key:
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+    if not url or not key:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables (or set STORAGE_BACKEND=sqlite)")
 
-supabase: Client = create_client(url, key)
+    supabase: Client = create_client(url, key)
 
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt."""
@@ -109,6 +115,27 @@ def activate_user(email: str):
         print(f"❌ Error activating user {email}: {str(e)}")
         return False
 
+def show_usage(days: int = 7):
+    """Show per-user daily LLM token usage from the llm_usage_daily view."""
+    try:
+        since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+        result = supabase.table('llm_usage_daily').select('*').gte('day', since).order('day', desc=True).execute()
+        
+        if result.data:
+            print(f"\n📊 LLM Usage (last {days} days):")
+            print("-" * 50)
+            for row in result.data:
+                print(f"Day: {row['day']}  User: {row['email'] or row['user_id']}")
+                print(f"Calls: {row['calls']} ({row['failed_calls']} failed)  Avg latency: {row['avg_latency_ms']} ms")
+                print(f"Tokens: {row['total_tokens']} (prompt {row['prompt_tokens']}, cached {row['cached_tokens']}, completion {row['completion_tokens']})  Cost: {row['cost']}")
+                print(f"Avg time to first token: {row['avg_ttft_ms']} ms")
+                print("-" * 50)
+        else:
+            print("No usage recorded.")
+            
+    except Exception as e:
+        print(f"❌ Error showing usage: {str(e)}")
+
 def main():
     """Main interactive menu."""
     print("🤖 Daddy John Chatbot - User Management")
@@ -120,9 +147,10 @@ def main():
         print("2. List all users")
         print("3. Deactivate user")
         print("4. Activate user")
-        print("5. Exit")
+        print("5. Show LLM usage")
+        print("6. Exit")
         
-        choice = input("\nEnter your choice (1-5): ").strip()
+        choice = input("\nEnter your choice (1-6): ").strip()
         
         if choice == '1':
             email = input("Enter email: ").strip()
@@ -151,11 +179,15 @@ def main():
                 print("❌ Email is required!")
                 
         elif choice == '5':
+            days = input("Number of days (default 7): ").strip()
+            show_usage(int(days) if days.isdigit() else 7)
+                
+        elif choice == '6':
             print("👋 Goodbye!")
             break
             
         else:
-            print("❌ Invalid choice! Please enter 1-5.")
+            print("❌ Invalid choice! Please enter 1-6.")
 
 if __name__ == "__main__":
     main()
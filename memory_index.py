@@ -0,0 +1,293 @@
+"""
+Local long-term memory for Daddy John Chatbot
+Per-user semantic index over past messages, used to pull the few most
+relevant old snippets into the prompt.
+
+Vectors come from feature hashing (word unigrams and bigrams hashed into a
+fixed number of signed buckets, L2-normalized), so no model download or
+external service is needed. Search is a brute-force NumPy dot product over
+the user's vectors, which stays in the low milliseconds for tens of
+thousands of messages.
+
+Each user's index is persisted as two append-only files in the index
+directory: ``<user_id>.vec`` (raw float32 rows) and ``<user_id>.jsonl``
+(one JSON-encoded text per row). Several worker processes may share the
+directory: writes hold an exclusive ``fcntl`` lock on ``<user_id>.lock`` and
+reads a shared one, and every access first picks up rows other processes
+appended since this process last looked. Rebuilds replace the files
+atomically and write a new token to ``<user_id>.gen``, which tells cached
+copies to reload from scratch.
+"""
+
+import os
+import re
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No cross-process locking (e.g. Windows); single worker only
+
+DEFAULT_DIM = 256
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset("""
+a an and are as at be but by do for from had has have i if in is it its me my
+of on or so that the then there this to was we were what when with you your
+""".split())
+
+def tokenize(text: str):
+    """Lowercase word tokens without stopwords."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+def embed(text: str, dim: int = DEFAULT_DIM) -> np.ndarray:
+    """Hash a text into a normalized float32 vector."""
+    vector = np.zeros(dim, dtype=np.float32)
+    tokens = tokenize(text)
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    for feature in features:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+        sign = 1.0 if digest & 1 else -1.0
+        vector[(digest >> 1) % dim] += sign
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+class _UserMemory:
+    """Vectors and texts for one user, mirroring the files on disk."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.texts = []
+        self.count = 0
+        self.vectors = np.zeros((64, self.dim), dtype=np.float32)
+        self.generation = None  # Token from the .gen file; changes when the index is rebuilt
+        self.text_offset = 0  # Bytes of the .jsonl file already loaded
+
+    def append(self, rows: np.ndarray, texts):
+        needed = self.count + len(texts)
+        if needed > len(self.vectors):
+            grown = np.zeros((max(needed, len(self.vectors) * 2), self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.count] = self.vectors[:self.count]
+            self.vectors = grown
+        self.vectors[self.count:needed] = rows
+        self.texts.extend(texts)
+        self.count = needed
+
+class MemoryIndex:
+    """Per-user hashed-vector index with incremental, on-disk persistence."""
+
+    def __init__(self, directory: str, dim: int = DEFAULT_DIM, max_items: int = 20000, max_users: int = 256):
+        self.directory = directory
+        self.dim = dim
+        self.max_items = max_items
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, user_id: str):
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', str(user_id))
+        base = os.path.join(self.directory, safe_id)
+        return base + '.vec', base + '.jsonl', base + '.lock', base + '.gen'
+
+    @contextmanager
+    def _file_lock(self, user_id: str, exclusive: bool):
+        """Hold the user's cross-process lock (shared for reads, exclusive for writes)."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._paths(user_id)[2], 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def loaded(self, user_id: str) -> bool:
+        """Whether the user's index is already in memory (searchable without a full load)."""
+        with self._lock:
+            return user_id in self._users
+
+    def has(self, user_id: str) -> bool:
+        """Whether an index exists for the user, in memory or on disk."""
+        with self._lock:
+            if user_id in self._users:
+                return True
+        return os.path.exists(self._paths(user_id)[1])
+
+    def warm(self, user_id: str) -> bool:
+        """Load the user's index from disk into memory. Returns False if none exists."""
+        return self._load(user_id) is not None
+
+    def _cache(self, user_id: str, memory: _UserMemory) -> _UserMemory:
+        with self._lock:
+            memory = self._users.setdefault(user_id, memory)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return memory
+
+    def _sync(self, user_id: str, memory: _UserMemory) -> bool:
+        """Read rows appended on disk since the last sync; reload fully after a rebuild.
+
+        The caller holds the user's file lock and memory.lock. Returns False
+        if the user has no index on disk. A torn final row is left unread.
+        """
+        vec_path, text_path, _, gen_path = self._paths(user_id)
+        if not os.path.exists(vec_path):
+            return False
+        try:
+            with open(gen_path, 'r', encoding='utf-8') as f:
+                generation = f.read()
+        except FileNotFoundError:
+            generation = ''
+
+        row_bytes = self.dim * 4
+        if generation != memory.generation or os.path.getsize(vec_path) < memory.count * row_bytes:
+            memory.reset()
+            memory.generation = generation
+
+        with open(vec_path, 'rb') as f:
+            f.seek(memory.count * row_bytes)
+            data = f.read()
+        vectors = np.frombuffer(data[:len(data) // row_bytes * row_bytes], dtype=np.float32).reshape(-1, self.dim)
+
+        texts = []
+        consumed = 0
+        with open(text_path, 'rb') as f:
+            f.seek(memory.text_offset)
+            for line in f:
+                if len(texts) == len(vectors) or not line.endswith(b'\n'):
+                    break
+                texts.append(json.loads(line))
+                consumed += len(line)
+
+        if texts:
+            memory.append(vectors[:len(texts)], texts)
+            memory.text_offset += consumed
+        return True
+
+    def _load(self, user_id: str):
+        """Return the user's up-to-date in-memory index, loading it from disk if needed."""
+        with self._lock:
+            memory = self._users.get(user_id)
+            if memory is not None:
+                self._users.move_to_end(user_id)
+
+        if memory is None:
+            if not os.path.exists(self._paths(user_id)[1]):
+                return None
+            memory = _UserMemory(self.dim)
+
+        with self._file_lock(user_id, exclusive=False), memory.lock:
+            if not self._sync(user_id, memory):
+                return None
+        return self._cache(user_id, memory)
+
+    def _replace(self, user_id: str, texts):
+        """Atomically replace the user's files with vectors for the given texts (file lock held)."""
+        vec_path, text_path, _, gen_path = self._paths(user_id)
+        rows = np.stack([embed(t, self.dim) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        with open(text_path + '.tmp', 'w', encoding='utf-8') as f:
+            for text in texts:
+                f.write(json.dumps(text) + '\n')
+        with open(vec_path + '.tmp', 'wb') as f:
+            f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+        with open(gen_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(text_path + '.tmp', text_path)
+        os.replace(vec_path + '.tmp', vec_path)
+        os.replace(gen_path + '.tmp', gen_path)
+
+    def build(self, user_id: str, texts):
+        """Replace the user's index with vectors for the given texts."""
+        texts = [t for t in texts if t][-self.max_items:]
+        memory = _UserMemory(self.dim)
+        with self._file_lock(user_id, exclusive=True), memory.lock:
+            self._replace(user_id, texts)
+            self._sync(user_id, memory)
+        with self._lock:
+            self._users.pop(user_id, None)
+        self._cache(user_id, memory)
+
+    def add(self, user_id: str, texts):
+        """Append texts to an existing index. Returns False if the user has none."""
+        texts = [t for t in texts if t]
+        memory = self._load(user_id)
+        if memory is None:
+            return False
+        if not texts:
+            return True
+
+        rows = np.stack([embed(t, self.dim) for t in texts])
+        vec_path, text_path = self._paths(user_id)[:2]
+        with self._file_lock(user_id, exclusive=True), memory.lock:
+            if not self._sync(user_id, memory):
+                return False
+
+            # Drop a torn final row left by a crashed writer so both files stay aligned
+            if os.path.getsize(vec_path) != memory.count * self.dim * 4:
+                os.truncate(vec_path, memory.count * self.dim * 4)
+            if os.path.getsize(text_path) != memory.text_offset:
+                os.truncate(text_path, memory.text_offset)
+
+            with open(text_path, 'a', encoding='utf-8') as f:
+                for text in texts:
+                    f.write(json.dumps(text) + '\n')
+            with open(vec_path, 'ab') as f:
+                f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+            self._sync(user_id, memory)
+
+            if memory.count > self.max_items * 1.25:
+                self._replace(user_id, memory.texts[-self.max_items:])
+                self._sync(user_id, memory)
+        return True
+
+    def search(self, user_id: str, query: str, k: int = 3, min_score: float = 0.2, exclude=()):
+        """Return up to k (score, text) pairs most similar to the query, including other workers' appends."""
+        memory = self._load(user_id)
+        if memory is None or not memory.count:
+            return []
+
+        q = embed(query, self.dim)
+        if not q.any():
+            return []
+
+        with memory.lock:
+            count = memory.count
+            scores = memory.vectors[:count] @ q
+            texts = memory.texts
+
+        # Over-fetch so excluded or duplicate texts don't starve the result
+        fetch = min(count, k * 4)
+        top = np.argpartition(-scores, fetch - 1)[:fetch]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        seen = set(exclude)
+        for i in top:
+            score = float(scores[i])
+            if score < min_score:
+                break
+            text = texts[i]
+            if text in seen:
+                continue
+            seen.add(text)
+            results.append((score, text))
+            if len(results) == k:
+                break
+        return results
@@ -0,0 +1,416 @@
+"""
+Embedded SQLite storage for Daddy John Chatbot
+Drop-in replacement for the Supabase client on single-node deployments,
+local development and benchmark runs.
+
+Only the slice of the Supabase/PostgREST query builder the app and the admin
+scripts use is implemented: ``table(...).select/insert/upsert/update`` with
+``eq``/``neq``/``gt``/``gte``/``lt``/``lte`` filters, ``order``, ``limit``
+and ``execute()``, plus ``rpc(...)`` for the database functions defined in
+``database_setup.sql``. Results expose ``.data`` like PostgREST responses.
+
+The schema mirrors ``database_setup.sql``. The database runs in WAL mode so
+readers never block the single writer, and every thread gets its own
+connection. Calls block the calling OS thread, so the client refuses to
+start once gevent has patched threading; serve it with sync or gthread
+workers.
+"""
+
+import re
+import sys
+import json
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invited_users (
+    id TEXT PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    is_active INTEGER DEFAULT 1,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL CHECK (role IN ('user', 'assistant', 'system')),
+    content TEXT NOT NULL,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    summary_text TEXT NOT NULL,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS conversation_state (
+    user_id TEXT PRIMARY KEY,
+    latest_summary TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    recent_messages TEXT NOT NULL DEFAULT '[]',
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    status TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    ttft_ms REAL,
+    retries INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ws_turns (
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    reply TEXT,
+    started_at REAL NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ws_turns_started_at ON ws_turns(started_at);
+
+-- Per-user history is always read newest- or oldest-first by (created_at, id),
+-- so one composite index serves recent history, summaries and export paging
+CREATE INDEX IF NOT EXISTS idx_messages_user_created_id ON messages(user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_summaries_user_created ON summaries(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_user_created ON llm_usage(user_id, created_at);
+
+CREATE VIEW IF NOT EXISTS llm_usage_daily AS
+SELECT
+    u.user_id,
+    iu.email,
+    substr(u.created_at, 1, 10) AS day,
+    COUNT(*) AS calls,
+    SUM(u.status <> 'ok') AS failed_calls,
+    SUM(u.prompt_tokens) AS prompt_tokens,
+    SUM(u.completion_tokens) AS completion_tokens,
+    SUM(u.total_tokens) AS total_tokens,
+    SUM(u.cost) AS cost,
+    ROUND(AVG(u.latency_ms), 1) AS avg_latency_ms,
+    SUM(u.retries) AS retries,
+    SUM(u.cached_tokens) AS cached_tokens,
+    ROUND(AVG(u.ttft_ms), 1) AS avg_ttft_ms
+FROM llm_usage u
+LEFT JOIN invited_users iu ON iu.id = u.user_id
+GROUP BY u.user_id, iu.email, substr(u.created_at, 1, 10);
+"""
+
+UUID_KEY_TABLES = {'invited_users', 'messages', 'summaries'}
+CREATED_AT_TABLES = {'invited_users', 'messages', 'summaries', 'llm_usage'}
+PRIMARY_KEYS = {'conversation_state': 'user_id', 'ws_turns': 'user_id,message_id'}
+JSON_COLUMNS = {'recent_messages'}
+BOOL_COLUMNS = {'is_active'}
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+FILTER_OPERATORS = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+def utc_now() -> str:
+    """Current time in the ISO format PostgREST returns for timestamptz."""
+    return datetime.now(timezone.utc).isoformat(timespec='microseconds')
+
+def _identifier(name: str) -> str:
+    name = name.strip()
+    if not IDENTIFIER.match(name):
+        raise ValueError(f"Invalid column or table name: {name!r}")
+    return name
+
+def _encode(column, value):
+    if column in JSON_COLUMNS or isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+def _decode(row: sqlite3.Row) -> dict:
+    data = dict(row)
+    for column in JSON_COLUMNS.intersection(data):
+        if isinstance(data[column], str):
+            data[column] = json.loads(data[column])
+    for column in BOOL_COLUMNS.intersection(data):
+        if data[column] is not None:
+            data[column] = bool(data[column])
+    return data
+
+class SQLiteResponse:
+    """Query result with the same `.data` attribute as a PostgREST response."""
+
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data) if isinstance(data, list) else None
+
+class SQLiteQuery:
+    """Chainable query builder for one table or view."""
+
+    def __init__(self, client, table: str):
+        self._client = client
+        self._table = _identifier(table)
+        self._action = 'select'
+        self._columns = '*'
+        self._payload = None
+        self._conflict = None
+        self._filters = []
+        self._order = []
+        self._limit = None
+
+    def select(self, columns: str = '*', count=None):
+        self._action = 'select'
+        self._columns = '*' if columns.strip() == '*' else ', '.join(_identifier(c) for c in columns.split(','))
+        return self
+
+    def insert(self, rows):
+        self._action, self._payload = 'insert', rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = None):
+        self._action, self._payload = 'upsert', rows
+        keys = (on_conflict or PRIMARY_KEYS.get(self._table, 'id')).split(',')
+        self._conflict = ', '.join(_identifier(k) for k in keys)
+        return self
+
+    def update(self, values: dict):
+        self._action, self._payload = 'update', values
+        return self
+
+    def delete(self):
+        self._action = 'delete'
+        return self
+
+    def _filter(self, operator, column, value):
+        self._filters.append((f"{_identifier(column)} {FILTER_OPERATORS[operator]} ?", [_encode(column, value)]))
+        return self
+
+    def eq(self, column, value):
+        return self._filter('eq', column, value)
+
+    def neq(self, column, value):
+        return self._filter('neq', column, value)
+
+    def gt(self, column, value):
+        return self._filter('gt', column, value)
+
+    def gte(self, column, value):
+        return self._filter('gte', column, value)
+
+    def lt(self, column, value):
+        return self._filter('lt', column, value)
+
+    def lte(self, column, value):
+        return self._filter('lte', column, value)
+
+    def order(self, column: str, desc: bool = False):
+        direction = 'DESC' if desc else 'ASC'
+        self._order.extend(f"{_identifier(c)} {direction}" for c in column.split(','))
+        return self
+
+    def limit(self, count: int):
+        self._limit = int(count)
+        return self
+
+    def _where(self):
+        if not self._filters:
+            return '', []
+        clauses = ' AND '.join(clause for clause, _ in self._filters)
+        params = [p for _, values in self._filters for p in values]
+        return f" WHERE {clauses}", params
+
+    def _prepare_rows(self):
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        prepared = []
+        for row in rows:
+            row = dict(row)
+            if self._table in UUID_KEY_TABLES and not row.get('id'):
+                row['id'] = str(uuid.uuid4())
+            if self._table in CREATED_AT_TABLES and not row.get('created_at'):
+                row['created_at'] = utc_now()
+            prepared.append(row)
+        return prepared
+
+    def _write_rows(self, conn):
+        results = []
+        for row in self._prepare_rows():
+            columns = [_identifier(c) for c in row]
+            sql = f"INSERT INTO {self._table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+            if self._action == 'upsert':
+                keys = {k.strip() for k in self._conflict.split(',')}
+                updates = [c for c in columns if c not in keys]
+                if updates:
+                    sql += f" ON CONFLICT ({self._conflict}) DO UPDATE SET " + ', '.join(f"{c} = excluded.{c}" for c in updates)
+                else:
+                    sql += f" ON CONFLICT ({self._conflict}) DO NOTHING"
+            sql += " RETURNING *"
+            results.extend(_decode(r) for r in conn.execute(sql, [_encode(c, row[c]) for c in columns]).fetchall())
+        return results
+
+    def execute(self) -> SQLiteResponse:
+        where, params = self._where()
+
+        if self._action == 'select':
+            sql = f"SELECT {self._columns} FROM {self._table}{where}"
+            if self._order:
+                sql += " ORDER BY " + ', '.join(self._order)
+            if self._limit is not None:
+                sql += f" LIMIT {self._limit}"
+            rows = self._client.connection().execute(sql, params).fetchall()
+            return SQLiteResponse([_decode(r) for r in rows])
+
+        with self._client.transaction() as conn:
+            if self._action in ('insert', 'upsert'):
+                return SQLiteResponse(self._write_rows(conn))
+
+            if self._action == 'update':
+                columns = [_identifier(c) for c in self._payload]
+                assignments = ', '.join(f"{c} = ?" for c in columns)
+                values = [_encode(c, self._payload[c]) for c in columns]
+                rows = conn.execute(f"UPDATE {self._table} SET {assignments}{where} RETURNING *", values + params).fetchall()
+            else:
+                rows = conn.execute(f"DELETE FROM {self._table}{where} RETURNING *", params).fetchall()
+            return SQLiteResponse([_decode(r) for r in rows])
+
+class SQLiteRPC:
+    """Deferred call to one of the database functions, run on execute()."""
+
+    def __init__(self, client, name: str, params: dict):
+        self._client = client
+        self._name = name
+        self._params = params or {}
+
+    def execute(self) -> SQLiteResponse:
+        handler = getattr(self._client, f"_rpc_{self._name}", None)
+        if handler is None:
+            raise ValueError(f"Unknown database function: {self._name}")
+        return SQLiteResponse(handler(**self._params))
+
+def _gevent_patched() -> bool:
+    """Whether gevent has replaced threading (greenlets share one OS thread)."""
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('threading')
+
+class SQLiteClient:
+    """Supabase-compatible client backed by a local SQLite file."""
+
+    def __init__(self, path: str, timeout: float = 5.0, call_timeout=None):
+        if _gevent_patched():
+            raise RuntimeError("SQLite storage needs sync or gthread workers, not gevent (gunicorn.conf.py picks gthread when STORAGE_BACKEND=sqlite)")
+
+        self.path = path
+        self.timeout = timeout
+        self.call_timeout = call_timeout  # Optional callable: per-call lock wait in seconds, or None
+        self._local = threading.local()
+
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,  # Autocommit; writes use explicit transactions
+                check_same_thread=False,
+                uri=self.path.startswith('file:')
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")  # Durable across app crashes in WAL mode
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-16000")  # 16 MB page cache per connection
+            conn.execute("PRAGMA mmap_size=268435456")
+            self._local.conn = conn
+            self._local.busy_timeout = self.timeout
+
+        busy_timeout = (self.call_timeout() if self.call_timeout else None) or self.timeout
+        if busy_timeout != self._local.busy_timeout:
+            conn.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+            self._local.busy_timeout = busy_timeout
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in one write transaction, taking the write lock up front."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def rpc(self, name: str, params: dict = None) -> SQLiteRPC:
+        return SQLiteRPC(self, name, params)
+
+    # --- Database functions (see database_setup.sql) ---
+
+    def _rpc_create_messages_table(self):
+        return None  # Created with the schema
+
+    def _rpc_ensure_messages_partitions(self):
+        return None  # SQLite tables are not partitioned
+
+    def _rpc_record_conversation_turn(self, p_user_id, p_messages, p_max_recent=20):
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT message_count, recent_messages FROM conversation_state WHERE user_id = ?",
+                (p_user_id,)
+            ).fetchone()
+            count = row['message_count'] if row else 0
+            recent = json.loads(row['recent_messages']) if row else []
+            recent = (recent + list(p_messages))[-p_max_recent:] if p_max_recent > 0 else []
+
+            updated = conn.execute(
+                "INSERT INTO conversation_state (user_id, message_count, recent_messages, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET message_count = excluded.message_count, "
+                "recent_messages = excluded.recent_messages, updated_at = excluded.updated_at RETURNING *",
+                (p_user_id, count + len(p_messages), json.dumps(recent), utc_now())
+            ).fetchone()
+        return _decode(updated)
+
+    def _rpc_users_needing_summary(self, p_min_unsummarized=20, p_limit=1000, p_offset=0):
+        rows = self.connection().execute("""
+            SELECT
+                m.user_id,
+                COUNT(*) AS total_messages,
+                SUM(s.last_summary_at IS NULL OR m.created_at > s.last_summary_at) AS unsummarized_messages
+            FROM messages m
+            LEFT JOIN (
+                SELECT user_id, MAX(created_at) AS last_summary_at FROM summaries GROUP BY user_id
+            ) s ON s.user_id = m.user_id
+            GROUP BY m.user_id
+            HAVING unsummarized_messages >= ?
+            ORDER BY unsummarized_messages DESC, m.user_id
+            LIMIT ? OFFSET ?
+        """, (p_min_unsummarized, p_limit, p_offset)).fetchall()
+        return [dict(r) for r in rows]
+
+    def _rpc_messages_page(self, p_user_id, p_after_created_at=None, p_after_id=None, p_limit=1000):
+        rows = self.connection().execute("""
+            SELECT id, role, content, created_at
+            FROM messages
+            WHERE user_id = ? AND (created_at, id) > (COALESCE(?, ''), COALESCE(?, ''))
+            ORDER BY created_at, id
+            LIMIT ?
+        """, (p_user_id, p_after_created_at, p_after_id, p_limit)).fetchall()
+        return [dict(r) for r in rows]
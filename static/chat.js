@@ -51,6 +51,7 @@ function addMessage(role, content) {
     
     chatWindow.appendChild(messageDiv);
     chatWindow.scrollTop = chatWindow.scrollHeight; // Auto-scroll
+    return messageDiv;
 }
 
 function showTypingIndicator() {
@@ -107,6 +108,176 @@ async function fetchChatHistory() {
     }
 }
 
+// --- Chat Transport (WebSocket with HTTP fallback) ---
+const SOCKET_URL = `${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws/chat`;
+const HEARTBEAT_INTERVAL_MS = 25000;
+const HEARTBEAT_TIMEOUT_MS = 10000;
+const RESUME_RETRY_MS = 2000;
+const BUSY_RETRY_MS = 500;
+const MAX_RECONNECT_DELAY_MS = 30000;
+
+let socket = null;
+let socketReady = false;
+let reconnectAttempts = 0;
+let heartbeatTimer = null;
+let heartbeatDeadline = null;
+let socketDisabled = !('WebSocket' in window);
+
+// Turns sent over the socket that are still waiting for a reply, by id
+const pendingTurns = new Map();
+
+function newMessageId() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+}
+
+function sendFrame(frame) {
+    if (!socket || socket.readyState !== WebSocket.OPEN) return false;
+    socket.send(JSON.stringify(frame));
+    return true;
+}
+
+function startHeartbeat() {
+    stopHeartbeat();
+    heartbeatTimer = setInterval(() => {
+        if (!sendFrame({ type: 'ping' })) return;
+        clearTimeout(heartbeatDeadline);
+        heartbeatDeadline = setTimeout(() => socket && socket.close(), HEARTBEAT_TIMEOUT_MS);
+    }, HEARTBEAT_INTERVAL_MS);
+}
+
+function stopHeartbeat() {
+    clearInterval(heartbeatTimer);
+    clearTimeout(heartbeatDeadline);
+}
+
+function resumePendingTurns() {
+    if (!pendingTurns.size) return;
+    sendFrame({ type: 'resume', ids: Array.from(pendingTurns.keys()) });
+}
+
+function settleTurn(id, reply) {
+    const turn = pendingTurns.get(id);
+    if (!turn) return;
+    pendingTurns.delete(id);
+    turn.resolve(reply);
+}
+
+function handleFrame(frame) {
+    const turn = frame.id ? pendingTurns.get(frame.id) : null;
+
+    switch (frame.type) {
+        case 'ready':
+            socketReady = true;
+            reconnectAttempts = 0;
+            startHeartbeat();
+            resumePendingTurns();
+            break;
+        case 'pong':
+            clearTimeout(heartbeatDeadline);
+            break;
+        case 'chunk':
+            if (turn) turn.onChunk(frame.delta);
+            break;
+        case 'reply':
+            settleTurn(frame.id, frame.reply);
+            break;
+        case 'pending':
+            setTimeout(resumePendingTurns, RESUME_RETRY_MS);
+            break;
+        case 'unknown':
+        case 'busy':
+            // Server never started (or lost) this turn; send it again shortly
+            if (turn) setTimeout(() => sendFrame({ type: 'message', id: frame.id, message: turn.message }), BUSY_RETRY_MS);
+            break;
+        case 'error':
+            console.error('Socket error:', frame.error);
+            if (frame.error === 'Invalid or expired token') {
+                socketDisabled = true;
+                pendingTurns.forEach((t) => t.reject(new Error('401 unauthorized')));
+                pendingTurns.clear();
+            }
+            break;
+    }
+}
+
+function connectSocket() {
+    if (socketDisabled || !authToken) return;
+
+    socket = new WebSocket(SOCKET_URL);
+
+    socket.addEventListener('open', () => {
+        sendFrame({ type: 'auth', token: authToken });
+    });
+
+    socket.addEventListener('message', (event) => {
+        try {
+            handleFrame(JSON.parse(event.data));
+        } catch (error) {
+            console.error('Bad socket frame:', error);
+        }
+    });
+
+    socket.addEventListener('close', () => {
+        const wasReady = socketReady;
+        socketReady = false;
+        stopHeartbeat();
+        if (socketDisabled) return;
+
+        if (!wasReady && reconnectAttempts >= 3) {
+            // Sockets are not available here (e.g. serverless); fall back to HTTP
+            socketDisabled = true;
+            pendingTurns.forEach((t) => t.fallback());
+            pendingTurns.clear();
+            return;
+        }
+
+        reconnectAttempts += 1;
+        const delay = Math.min(MAX_RECONNECT_DELAY_MS, 500 * 2 ** reconnectAttempts);
+        setTimeout(connectSocket, delay);
+    });
+}
+
+async function sendViaHttp(message) {
+    const response = await fetch('/api/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${authToken}`
+        },
+        body: JSON.stringify({ message: message })
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.error || `Server responded with status: ${response.status}`);
+    }
+
+    const data = await response.json();
+    if (!data.reply) {
+        throw new Error('Invalid response format');
+    }
+    return data.reply;
+}
+
+function sendChatMessage(message, onChunk) {
+    if (socketDisabled || !socketReady) {
+        return sendViaHttp(message);
+    }
+
+    return new Promise((resolve, reject) => {
+        const id = newMessageId();
+        pendingTurns.set(id, {
+            message,
+            onChunk,
+            resolve,
+            reject,
+            fallback: () => sendViaHttp(message).then(resolve, reject)
+        });
+        sendFrame({ type: 'message', id, message });
+    });
+}
+
 // --- Emoji Picker Setup ---
 const EMOJIS = [
   '😀','😁','😂','🤣','😊','😍','😘','😎','🤩','🥳',
@@ -321,32 +492,30 @@ chatForm.addEventListener('submit', async (e) => {
     
     showTypingIndicator();
 
+    let streamingDiv = null;
+
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'Authorization': `Bearer ${authToken}`
-            },
-            body: JSON.stringify({ message: message })
+        const reply = await sendChatMessage(message, (delta) => {
+            if (!streamingDiv) {
+                hideTypingIndicator();
+                streamingDiv = addMessage('assistant', '');
+            }
+            streamingDiv.textContent += delta.replace(/[<>]/g, '');
+            chatWindow.scrollTop = chatWindow.scrollHeight;
         });
 
         hideTypingIndicator();
 
-        if (!response.ok) {
-            const errorData = await response.json().catch(() => ({}));
-            throw new Error(errorData.error || `Server responded with status: ${response.status}`);
-        }
-
-        const data = await response.json();
-        if (data.reply) {
-            addMessage('assistant', data.reply);
+        // The final reply is cleaned server-side, so it replaces the streamed text
+        if (streamingDiv) {
+            streamingDiv.textContent = reply.replace(/[<>]/g, '');
         } else {
-            throw new Error('Invalid response format');
+            addMessage('assistant', reply);
         }
 
     } catch (error) {
         hideTypingIndicator();
+        if (streamingDiv) streamingDiv.remove();
         console.error('Error sending message:', error);
         
         let errorMessage = "Oh, crumbs. Something went wrong on my end, kiddo.";
@@ -391,4 +560,4 @@ logoutButton.addEventListener('click', async () => {
 });
 
 // --- Initial Load ---
-checkSession();
\ No newline at end of file
+checkSession().then(connectSocket);
\ No newline at end of file